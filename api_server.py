@@ -0,0 +1,146 @@
+"""Local HTTP/JSON API for answering trip searches from a long-running planner process.
+
+Start it with:
+    python weather_trip_planner.py --serve[=PORT] [--concurrency=N] [--quiet]
+
+Endpoints:
+    GET  /search?cities=Ocean City, MD %26 Virginia Beach, VA&trip_length=1-3&max_price=300
+    POST /search   {"cities": ["Ocean City, MD", "Virginia Beach, VA"], "trip_length": 2, "max_price": 300}
+    POST /batch    {"queries": [{...search...}, {...search...}]}  each city fetched once for all queries
+    GET  /stats    HTTP, connection and cache counters
+    GET  /health
+
+Searches accept the same ranking parameters as the command line
+(rank, top, max_rain, comfort, weights, any_day).
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+log = logging.getLogger('weather_trip_planner.api')
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 1024 * 1024
+
+class PlannerHandler(BaseHTTPRequestHandler):
+    """Routes /search, /batch, /stats and /health to the planner callbacks on the server."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/search':
+            self.search({name: values[-1] for name, values in parse_qs(parts.query).items()})
+        elif parts.path == '/stats':
+            with self.server.stats_lock:
+                api_stats = dict(self.server.stats)
+            self.send_json(200, {'api': api_stats, 'planner': self.server.stats_function()})
+        elif parts.path == '/health':
+            self.send_json(200, {'status': 'ok', 'uptime_seconds': round(time.time() - self.server.started_at, 1)})
+        else:
+            self.send_json(404, {'error': f"Unknown path: {parts.path}"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path not in ('/search', '/batch'):
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_SIZE:
+            # The body wasn't read, so the connection can't be reused
+            self.close_connection = True
+            self.send_json(400, {'error': f"Content-Length must be a number of bytes up to {MAX_BODY_SIZE}"})
+            return
+        try:
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': 'Request body must be JSON'})
+            return
+        if not isinstance(params, dict):
+            self.send_json(400, {'error': 'Request body must be a JSON object'})
+            return
+        if path == '/batch':
+            self.batch(params)
+        else:
+            self.search(params)
+
+    def search(self, params):
+        with self.server.stats_lock:
+            self.server.stats['searches'] += 1
+        try:
+            payload = self.server.search_function(params)
+        except ValueError as e:
+            with self.server.stats_lock:
+                self.server.stats['bad_requests'] += 1
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            with self.server.stats_lock:
+                self.server.stats['errors'] += 1
+            log.exception("Search failed")
+            self.send_json(500, {'error': f"Search failed: {e}"})
+            return
+        self.send_json(200, payload)
+
+    def batch(self, params):
+        queries = params.get('queries')
+        if not isinstance(queries, list):
+            self.send_json(400, {'error': 'queries must be a list of searches'})
+            return
+        with self.server.stats_lock:
+            self.server.stats['batches'] += 1
+            self.server.stats['searches'] += len(queries)
+        try:
+            payload = {'queries': self.server.batch_function(queries)}
+        except Exception as e:
+            with self.server.stats_lock:
+                self.server.stats['errors'] += 1
+            log.exception("Batch failed")
+            self.send_json(500, {'error': f"Batch failed: {e}"})
+            return
+        self.send_json(200, payload)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+def run_one(search_function, params):
+    """Run one query of a batch, turning bad parameters into an error entry."""
+    try:
+        return search_function(params)
+    except ValueError as e:
+        return {'error': str(e)}
+
+def start_server(search_function, stats_function, port=0, host='127.0.0.1', batch_function=None):
+    """Start the API on a background thread. Returns (server, base_url).
+
+    search_function(params) returns a JSON-ready dict and raises ValueError for
+    bad parameters; stats_function() returns a dict of counters.
+    batch_function(queries) returns one JSON-ready dict per query; without it
+    each query in a batch is run through search_function.
+    """
+    server = ThreadingHTTPServer((host, port), PlannerHandler)
+    server.daemon_threads = True
+    server.search_function = search_function
+    server.stats_function = stats_function
+    server.batch_function = batch_function or (lambda queries: [run_one(search_function, query) for query in queries])
+    server.stats = {'searches': 0, 'batches': 0, 'bad_requests': 0, 'errors': 0}
+    server.stats_lock = threading.Lock()
+    server.started_at = time.time()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
@@ -0,0 +1,334 @@
+"""Benchmarks for weather_trip_planner built on the sample/ HTML fixtures.
+
+Usage: python benchmark.py [--repeat=N] [--filter=TEXT] [--save-baseline] [--baseline=PATH]
+
+HTTP is stubbed to serve the fixtures, so no network access is needed. Each
+benchmark reports the best time per call, throughput and peak memory, and is
+compared against the stored baseline when one exists.
+"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import weather_trip_planner as planner
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample')
+PLANNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weather_trip_planner.py')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+COASTAL_PLACES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coastal_places.txt')
+DEFAULT_REPEAT = 5
+
+def read_fixture(name):
+    with open(os.path.join(SAMPLE_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+SEARCH_HTML = read_fixture('sample_search_results.html')
+FORECAST_HTML = read_fixture('sample_weather_report.html')
+HOTELS_HTML = read_fixture('expedia_results.html')
+
+class FixtureResponse:
+    """Just enough of requests.Response for the planner's code paths."""
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+def fixture_http_get(url, headers=None, stream=False, budgeted=True):
+    """Stand-in for planner.http_get that serves the sample pages."""
+    if '?query=' in url:
+        return FixtureResponse(SEARCH_HTML)
+    if '/Hotel-Search?' in url:
+        return FixtureResponse(HOTELS_HTML)
+    return FixtureResponse(FORECAST_HTML)
+
+@contextlib.contextmanager
+def stubbed_planner():
+    """Serve fixtures instead of the network, use a throwaway cache dir and always take the cold path."""
+    original_get = planner.http_get
+    original_cache_dir = planner.CACHE_DIR
+    with tempfile.TemporaryDirectory() as cache_dir:
+        planner.http_get = fixture_http_get
+        planner.CACHE_DIR = cache_dir
+        planner.configure_location_cache(refresh=True)
+        planner.configure_forecast_cache(refresh=True)
+        planner.configure_hotel_cache(refresh=True)
+        try:
+            yield
+        finally:
+            planner.http_get = original_get
+            planner.CACHE_DIR = original_cache_dir
+            planner.configure_location_cache(refresh=False)
+            planner.configure_forecast_cache(refresh=False)
+            planner.configure_hotel_cache(refresh=False)
+
+def synthetic_forecast(num_days, seed=0, first_date=datetime.date(2026, 5, 1)):
+    """A forecast_data list of any length with plausible random weather."""
+    rng = random.Random(seed)
+    forecast_data = []
+    for offset in range(num_days):
+        date = first_date + datetime.timedelta(days=offset)
+        rain_probability = rng.choice([None, 0, 5, 10, 20, 30, 40, 60, 80])
+        high = rng.randint(60, 95)
+        forecast_data.append({
+            'date': date,
+            'day_of_week': date.strftime('%a'),
+            'description': 'Showers.' if (rain_probability or 0) > 40 else 'Sunny.',
+            'has_rain': (rain_probability or 0) > 20,
+            'rain_probability': rain_probability,
+            'temp_high': high,
+            'temp_low': high - rng.randint(5, 20),
+        })
+    return forecast_data
+
+def parsed_sample_forecast():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return planner.parse_forecast(FORECAST_HTML)
+
+def scan_cities(city_names, concurrency, parse_workers=0):
+    """Full multi-city pipeline with location IDs cached, as on a typical repeat scan.
+
+    search_location has its own benchmark; here every city still downloads,
+    parses and searches its forecast. With parse_workers the parsing goes to a
+    process pool; the time includes starting the workers.
+    """
+    planner.configure_location_cache(refresh=False)
+    planner.configure_parse_pool(workers=parse_workers)
+    try:
+        return planner.process_cities(city_names, [1, 2, 3], 300, concurrency)
+    finally:
+        planner.configure_location_cache(refresh=True)
+        planner.configure_parse_pool(workers=0)
+
+def run_batch(queries):
+    """Batch pipeline with location IDs cached, comparable to scan_cities."""
+    planner.configure_location_cache(refresh=False)
+    try:
+        return planner.run_batch(queries, 8)
+    finally:
+        planner.configure_location_cache(refresh=True)
+
+class StandInProvider(planner.TimeanddateProvider):
+    """A fixture-served forecast provider where every Nth answer is slow."""
+    def __init__(self, name, base_url, delay, slow_delay=0, slow_every=0):
+        super().__init__(name, base_url)
+        self.delay = delay
+        self.slow_delay = slow_delay
+        self.slow_every = slow_every
+        self.calls = 0
+
+    def fetch(self, location_id, etag=None, last_modified=None, stream=False):
+        self.calls += 1
+        slow = self.slow_every and self.calls % self.slow_every == 0
+        time.sleep(self.slow_delay if slow else self.delay)
+        return super().fetch(location_id, etag, last_modified, stream)
+
+def fetch_forecasts(count, hedged):
+    """Fetch `count` forecasts from a primary whose every 10th answer takes 100 ms, optionally hedged to a mirror."""
+    primary = StandInProvider('stand-in', 'https://primary.invalid', 0.002, 0.1, 10)
+    mirror = StandInProvider('stand-in mirror', 'https://mirror.invalid', 0.005)
+    # Start from a histogram that has already seen the primary's usual latency
+    for _ in range(planner.HEDGE_MIN_SAMPLES):
+        primary.latency.record(0.002)
+    planner.register_provider(primary)
+    planner.register_provider(mirror)
+    planner.configure_providers(primary=primary.name, backup=mirror.name if hedged else '')
+    try:
+        return [planner.get_forecast_data(str(location_id)) for location_id in range(count)]
+    finally:
+        planner.configure_providers(primary='timeanddate', backup='')
+
+def plan_budget(city_names, budget):
+    """Plan a scan of city_names under a per-run request budget."""
+    planner.configure_budget(per_run=budget)
+    try:
+        return planner.plan_requests(city_names)
+    finally:
+        planner.configure_budget(per_run=0)
+
+def cold_start(*args):
+    """Run the planner in a fresh interpreter, as a short CLI invocation does."""
+    subprocess.run([sys.executable, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+def warm_process_city(city_name):
+    """process_city with its location and forecast cached: the fixed cost of one more city in a scan."""
+    planner.configure_location_cache(refresh=False)
+    planner.configure_forecast_cache(refresh=False)
+    try:
+        return planner.process_city(city_name, 2, 300)
+    finally:
+        planner.configure_location_cache(refresh=True)
+        planner.configure_forecast_cache(refresh=True)
+
+def hotel_periods(count, distinct):
+    """Results whose Expedia searches repeat, as when periods overlap or a city is spelled several ways."""
+    start = datetime.date(2026, 5, 22)
+    return [{'expedia_url': planner.generate_expedia_url('Virginia Beach', 'VA', start + datetime.timedelta(days=i % distinct),
+                                                         start + datetime.timedelta(days=i % distinct + 2), 300)}
+            for i in range(count)]
+
+def record_history(forecast, count):
+    """Queue and bulk-write `count` forecasts to a throwaway history database."""
+    with tempfile.TemporaryDirectory() as history_dir:
+        planner.configure_forecast_history(enabled=True, path=os.path.join(history_dir, 'history.sqlite'))
+        try:
+            fetched_at = time.time()
+            for location_id in range(count):
+                planner.record_forecast_history(str(location_id), fetched_at, forecast)
+            planner.flush_forecast_history()
+        finally:
+            planner.configure_forecast_history(enabled=False, path='')
+
+def build_benchmarks():
+    """Return (name, calls_per_round, rounds, function[, cities_per_call]) for every benchmark.
+
+    rounds=None means use the suite-wide --repeat setting. Benchmarks that
+    give cities_per_call also report throughput in cities per second.
+    """
+    # Forecasts reach find_suitable_periods as tables, as they do in the pipeline
+    sample_forecast = planner.as_forecast_table(parsed_sample_forecast())
+    year_forecast = planner.as_forecast_table(synthetic_forecast(365, seed=1))
+    many_cities = [{'forecast_data': synthetic_forecast(14, seed=seed)} for seed in range(500)]
+    city_names = ["Ocean City, MD"] * 200
+    places = planner.read_city_list(COASTAL_PLACES)[:200]
+    # The batch needs places that resolve offline, so take them from the gazetteer
+    with open(planner.GAZETTEER_PATH) as f:
+        coast = [f"{place['name']}, {place['state']}" for place in json.load(f)['places']]
+    batch_queries = [{'cities': coast, 'trip_length': length, 'max_price': price}
+                     for length in ('1', '2', '3', '1-3') for price in range(100, 600, 50)]
+    gazetteer_names = ["Ocean City, MD", "Ocen City, MD", "Virginia Beach, VA", "Sea Isle City, NJ"] * 50
+    start = datetime.date(2026, 5, 22)
+    end = datetime.date(2026, 5, 24)
+
+    benchmarks = [
+        ('cold start: import', 1, None, lambda: cold_start('-c', 'import weather_trip_planner')),
+        ('cold start: --help', 1, None, lambda: cold_start(PLANNER_SCRIPT, '--help')),
+        ('search_location (fixture)', 10, None, lambda: planner.search_location('Ocean City, MD')),
+        ('gazetteer_lookup 200 cities', 10, None, lambda: [planner.gazetteer_lookup(name) for name in gazetteer_names]),
+        ('parse_forecast', 50, None, lambda: planner.parse_forecast(FORECAST_HTML)),
+        ('parse_forecast_soup', 10, None, lambda: planner.parse_forecast_soup(FORECAST_HTML)),
+        ('find_suitable_periods 14d x 1 length', 2000, None, lambda: planner.find_suitable_periods(sample_forecast, 2)),
+        ('find_suitable_periods 14d x 1-5 lengths', 1000, None, lambda: planner.find_suitable_periods(sample_forecast, range(1, 6))),
+        ('ForecastTable.from_days 1000 forecasts', 1, None,
+         lambda: [planner.ForecastTable.from_days(sample_forecast) for _ in range(1000)]),
+        ('record_forecast_history 500 forecasts', 1, None, lambda: record_history(sample_forecast, 500)),
+        ('find_suitable_periods 365d x 1-7 lengths', 20, None, lambda: planner.find_suitable_periods(year_forecast, range(1, 8))),
+        ('generate_expedia_url', 20000, None, lambda: planner.generate_expedia_url('Ocean City', 'MD', start, end, 300)),
+        ('get_forecast_data 50 forecasts, slow primary', 1, None, lambda: fetch_forecasts(50, hedged=False)),
+        ('get_forecast_data 50 forecasts, hedged', 1, None, lambda: fetch_forecasts(50, hedged=True)),
+        ('plan_requests 200 cities, budget 50', 10, None, lambda: plan_budget(places, 50)),
+        ('process_city (fixture)', 10, None, lambda: planner.process_city('Ocean City, MD', 2, 300)),
+        ('process_city, caches warm', 200, None, lambda: warm_process_city('Ocean City, MD')),
+        ('parse_hotel_results', 50, None, lambda: planner.parse_hotel_results(HOTELS_HTML)),
+        ('parse_hotel_cards', 10, None, lambda: planner.parse_hotel_cards(HOTELS_HTML)),
+        ('attach_hotel_results 200 periods, 4 searches', 10, None,
+         lambda: planner.attach_hotel_results(hotel_periods(200, 4), concurrency=4)),
+        # Scale-up runs are long enough that a single round is representative
+        ('run_batch 40 queries x 15 cities', 1, 1, lambda: run_batch(batch_queries), len(coast)),
+        ('process_cities 200 cities', 1, 1, lambda: scan_cities(city_names, 1), len(city_names)),
+        ('process_cities 200 cities, 8 workers', 1, 1, lambda: scan_cities(city_names, 8), len(city_names)),
+        ('process_cities 200 cities, 8 workers, parse pool', 1, 1,
+         lambda: scan_cities(city_names, 8, os.cpu_count() or 1), len(city_names)),
+    ]
+
+    try:
+        import numpy  # noqa: F401
+        benchmarks.append(('score_windows 500 cities x 1-5 lengths', 20, None,
+                           lambda: planner.score_windows(many_cities, range(1, 6), top_k=10)))
+    except ImportError:
+        pass
+
+    return benchmarks
+
+def time_benchmark(function, number, repeat):
+    """Best wall time per call over `repeat` rounds of `number` calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def peak_memory(function):
+    """Peak traced allocation in bytes during one call."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmarks(repeat=DEFAULT_REPEAT, name_filter=None):
+    """Run the suite and return {name: {'seconds', 'per_second', 'peak_bytes'[, 'cities_per_second']}}."""
+    results = {}
+    with stubbed_planner():
+        for name, number, rounds, function, *cities in build_benchmarks():
+            if name_filter and name_filter.lower() not in name.lower():
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                if rounds is None:
+                    function()  # Warm up
+                seconds = time_benchmark(function, number, rounds or repeat)
+                peak_bytes = peak_memory(function)
+            results[name] = {
+                'seconds': seconds,
+                'per_second': 1 / seconds if seconds else float('inf'),
+                'peak_bytes': peak_bytes,
+            }
+            if cities:
+                results[name]['cities_per_second'] = cities[0] / seconds if seconds else float('inf')
+            print_result(name, results[name])
+    return results
+
+def print_result(name, result, baseline=None):
+    line = (f"{name:<42} {result['seconds'] * 1000:>10.3f} ms {result['per_second']:>12.1f}/s "
+            f"{result['peak_bytes'] / 1024:>10.1f} KiB")
+    if 'cities_per_second' in result:
+        line += f" {result['cities_per_second']:>10.1f} cities/s"
+    if baseline:
+        change = (result['seconds'] / baseline['seconds'] - 1) * 100
+        line += f"   {change:+6.1f}% vs baseline"
+    print(line)
+
+def main():
+    options, _ = planner.parse_options(sys.argv[1:])
+    baseline_path = options.get('baseline', DEFAULT_BASELINE)
+    repeat = int(options.get('repeat', DEFAULT_REPEAT))
+
+    print(f"{'benchmark':<42} {'time/call':>13} {'throughput':>14} {'peak mem':>14}")
+    results = run_benchmarks(repeat, options.get('filter'))
+
+    if options.get('save_baseline'):
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print(f"\nSaved baseline to {baseline_path}")
+        return
+
+    try:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print(f"\nNo baseline at {baseline_path}; run with --save-baseline to create one")
+        return
+
+    print(f"\nCompared with {baseline_path}:")
+    for name, result in results.items():
+        if name in baseline:
+            print_result(name, result, baseline[name])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Record/replay fixture store and a local stand-in HTTP server for offline runs.
+
+Record real responses with:
+    python weather_trip_planner.py --record=fixtures/ 2 300 "Ocean City, MD & Virginia Beach, VA"
+
+Replay them through the planner (the stand-in starts automatically):
+    python weather_trip_planner.py --replay=fixtures/ --replay-latency=50-200 --replay-error-rate=0.05 2 300 "..."
+
+Or run the stand-in on its own for other tools:
+    python replay_server.py fixtures/ [--port=8000] [--latency=MS or LOW-HIGH] [--error-rate=0.05]
+"""
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+INDEX_FILE = 'index.json'
+
+# Response headers worth replaying
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+def request_key(url):
+    """Key a request by path and query, so one store can serve any host."""
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+class FixtureStore:
+    """A directory of recorded response bodies plus an index of status and headers."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        try:
+            with open(os.path.join(directory, INDEX_FILE)) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def record(self, url, status_code, headers, body):
+        """Save one response. A later recording of the same request replaces it."""
+        key = request_key(url)
+        filename = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.body'
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, filename), 'wb') as f:
+            f.write(body)
+
+        with self.lock:
+            self.index[key] = {
+                'url': url,
+                'status': status_code,
+                'headers': {name: headers[name] for name in RECORDED_HEADERS if headers.get(name)},
+                'file': filename,
+                'recorded_at': time.time(),
+            }
+            tmp_path = os.path.join(self.directory, INDEX_FILE + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, os.path.join(self.directory, INDEX_FILE))
+
+    def lookup(self, key):
+        """Return (entry, body) for a request key, or (None, None)."""
+        entry = self.index.get(key)
+        if entry is None:
+            return None, None
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            return entry, f.read()
+
+def parse_latency(value):
+    """Parse '50' or '20-200' (milliseconds) into a (low, high) range in seconds."""
+    if not value:
+        return 0.0, 0.0
+    low, _, high = str(value).partition('-')
+    low = float(low) / 1000
+    high = float(high) / 1000 if high else low
+    return low, max(low, high)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves recorded responses with injected latency and errors."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        low, high = server.latency
+        if high:
+            time.sleep(random.uniform(low, high))
+
+        with server.stats_lock:
+            server.stats['requests'] += 1
+
+        if server.error_rate and random.random() < server.error_rate:
+            with server.stats_lock:
+                server.stats['injected_errors'] += 1
+            self.send_body(503, {'Content-Type': 'text/plain', 'Retry-After': '0'}, b'Injected error')
+            return
+
+        entry, body = server.store.lookup(self.path)
+        if entry is None:
+            with server.stats_lock:
+                server.stats['misses'] += 1
+            self.send_body(404, {'Content-Type': 'text/plain'}, b'Not recorded')
+            return
+
+        headers = dict(entry['headers'])
+        etag = headers.get('ETag')
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_body(304, headers, b'')
+            return
+
+        self.send_body(entry['status'], headers, body)
+
+    def send_body(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(store_dir, latency=None, error_rate=0.0, port=0, host='127.0.0.1'):
+    """Start the stand-in on a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.store = FixtureStore(store_dir)
+    server.latency = parse_latency(latency)
+    server.error_rate = float(error_rate or 0)
+    server.stats = {'requests': 0, 'misses': 0, 'injected_errors': 0}
+    server.stats_lock = threading.Lock()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
+
+def main():
+    options = {}
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            options[name.replace('-', '_')] = value
+        else:
+            args.append(arg)
+    if not args:
+        print(__doc__)
+        return
+
+    server, base_url = start_server(
+        args[0], options.get('latency'), options.get('error_rate', 0), int(options.get('port', 8000))
+    )
+    print(f"Serving {len(server.store.index)} recorded responses from {args[0]} at {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
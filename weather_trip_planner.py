@@ -1,556 +1,4011 @@
-import requests
-from bs4 import BeautifulSoup
+import atexit
+import bisect
+import codecs
+import contextlib
 import datetime
+import functools
+import hashlib
+import heapq
+import html
+import importlib.util
+import logging
+import random
 import re
 import sys
 import json
-import webbrowser
-from urllib.parse import quote, quote_plus
+import os
+import queue
+import time
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from urllib.parse import quote, quote_plus, urlsplit
+
+# requests, bs4, sqlite3, multiprocessing and webbrowser are imported where
+# they are first needed, so --help and usage errors start without them
+log = logging.getLogger('weather_trip_planner')
+
+# Where persistent caches live (override with TRIP_PLANNER_CACHE_DIR)
+CACHE_DIR = os.environ.get(
+    'TRIP_PLANNER_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'weather_trip_planner')
+)
+
+# Base URL for timeanddate.com requests (pointed at a local stand-in when replaying)
+TIMEANDDATE_BASE_URL = 'https://www.timeanddate.com'
+
+# Number of cities processed at once (1 = one city at a time)
+DEFAULT_CONCURRENCY = 1
+
+# Politeness cap: never have more than this many requests in flight to a single host
+DEFAULT_PER_HOST_LIMIT = 2
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+_per_host_limit = DEFAULT_PER_HOST_LIMIT
+
+def set_per_host_limit(limit):
+    """Set the maximum number of concurrent requests allowed per host."""
+    global _per_host_limit
+    with _host_semaphores_lock:
+        _per_host_limit = max(1, int(limit))
+        _host_semaphores.clear()
+
+def host_slot(url):
+    """Return the semaphore guarding concurrent requests to the URL's host."""
+    host = urlsplit(url).hostname
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(_per_host_limit)
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+# Only advertise brotli when urllib3 can actually decode it
+if importlib.util.find_spec('brotli') or importlib.util.find_spec('brotlicffi'):
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+else:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept-Encoding': ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+}
+
+# (connect, read) timeouts in seconds
+REQUEST_TIMEOUT = (5, 20)
+
+# Retry transient failures with jittered exponential backoff
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Keep-alive connections kept per host
+POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+# Fixture store that successful responses are copied into (see --record)
+_recorder = None
+
+# Counters for HTTP and cache events, reported by --stats
+_event_counters = {'requests': 0, 'retries': 0, 'failures': 0}
+_event_counters_lock = threading.Lock()
+
+def get_session():
+    """Return the shared pooled session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=max(POOL_SIZE, _per_host_limit))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+    return _session
+
+# Per-thread context: the city being processed and, when profiling, its metrics record
+_context = threading.local()
+_metrics_records = []
+_metrics_lock = threading.Lock()
+_metrics_enabled = False
+
+def enable_metrics(enabled=True):
+    """Turn per-city stage timing and counters on or off."""
+    global _metrics_enabled
+    _metrics_enabled = enabled
+
+def collected_metrics():
+    """Return (and clear) the per-city metrics records collected so far."""
+    with _metrics_lock:
+        records = list(_metrics_records)
+        _metrics_records.clear()
+    return records
+
+def current_city():
+    """The city this thread is working on, if any."""
+    return getattr(_context, 'city', None)
+
+@contextlib.contextmanager
+def city_metrics(city_name):
+    """Mark this thread as working on a city and, if enabled, collect its metrics."""
+    previous_city = current_city()
+    previous_record = getattr(_context, 'record', None)
+    record = None
+    if _metrics_enabled:
+        record = {'type': 'city', 'city': city_name, 'stages': {}, 'counters': {}}
+    
+    _context.city = city_name
+    _context.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _context.city = previous_city
+        _context.record = previous_record
+        if record is not None:
+            record['wall_seconds'] = time.perf_counter() - start
+            with _metrics_lock:
+                _metrics_records.append(record)
+
+@contextlib.contextmanager
+def stage(name):
+    """Add the wall time of the enclosed block to the current city's stage timings."""
+    record = getattr(_context, 'record', None)
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = record['stages']
+        stages[name] = stages.get(name, 0) + time.perf_counter() - start
+
+def count_event(name, amount=1):
+    """Increment one of the HTTP/cache event counters, globally and for the current city."""
+    with _event_counters_lock:
+        _event_counters[name] = _event_counters.get(name, 0) + amount
+    record = getattr(_context, 'record', None)
+    if record is not None:
+        counters = record['counters']
+        counters[name] = counters.get(name, 0) + amount
+
+def transport_stats():
+    """Return the event counters plus new vs reused connection counts."""
+    with _event_counters_lock:
+        stats = dict(_event_counters)
+    
+    new_connections = 0
+    pooled_requests = 0
+    if _session is not None:
+        # The same adapter is mounted for http and https; count it once
+        adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                new_connections += pool.num_connections
+                pooled_requests += pool.num_requests
+    
+    stats['new_connections'] = new_connections
+    stats['reused_connections'] = max(0, pooled_requests - new_connections)
+    return stats
+
+def backoff_delay(attempt, response=None):
+    """Seconds to wait before retry number `attempt` (0-based)."""
+    # Honour an explicit Retry-After from the server when it gives seconds
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    # Full jitter: uniform between 0 and the exponential cap
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def set_recorder(store):
+    """Copy every successful non-streamed response into a replay_server.FixtureStore (None to stop)."""
+    global _recorder
+    _recorder = store
+
+def response_size(response):
+    """Bytes received for a fully read response (compressed size when available)."""
+    raw = getattr(response, 'raw', None)
+    try:
+        return raw.tell()
+    except Exception:
+        return len(response.content or b'')
+
+def release_on_close(response, slot):
+    """Hold a host slot until a streamed response is closed, then release it once."""
+    close = response.close
+    held = [slot]
+    
+    def close_and_release():
+        try:
+            close()
+        finally:
+            try:
+                held.pop().release()
+            except IndexError:
+                pass
+    
+    response.close = close_and_release
+
+def http_get(url, headers=None, stream=False, budgeted=True):
+    """GET a URL through the shared session, retrying transient failures.
+    
+    Waits for a free slot on the URL's host before each attempt. Returns the
+    final response (which may still be an error status once retries run out);
+    network errors are re-raised after the last attempt. With stream=True the
+    body is left unread for the caller to consume, and the host slot stays
+    taken until the caller closes the response. Every attempt counts against
+    the request budget unless budgeted is False.
+    """
+    import requests
+    
+    session = get_session()
+    
+    for attempt in range(MAX_RETRIES + 1):
+        count_event('requests')
+        if budgeted:
+            spend_request()
+        response = None
+        try:
+            slot = host_slot(url)
+            slot.acquire()
+            try:
+                response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=stream)
+            finally:
+                # A streamed body is still to come over the connection
+                if response is not None and stream:
+                    release_on_close(response, slot)
+                else:
+                    slot.release()
+            if not stream:
+                count_event('bytes_downloaded', response_size(response))
+                if _recorder is not None and response.status_code == 200:
+                    _recorder.record(url, response.status_code, response.headers, response.content)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt == MAX_RETRIES:
+                count_event('failures')
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                count_event('failures')
+                raise
+        
+        count_event('retries')
+        if response is not None:
+            response.close()
+        # Sleep outside the host slot so other cities can use it meanwhile
+        time.sleep(backoff_delay(attempt, response))
+
+STATE_ABBR_TO_NAME = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
+    'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
+    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
+    'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri',
+    'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey',
+    'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
+    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+    'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
+    'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
+    'DC': 'District of Columbia'
+}
+
+STATE_NAME_TO_ABBR = {name.lower(): abbr for abbr, name in STATE_ABBR_TO_NAME.items()}
+# Lower-case abbreviations and names, both mapping to the abbreviation
+STATE_LOOKUP = dict(STATE_NAME_TO_ABBR, **{abbr.lower(): abbr for abbr in STATE_ABBR_TO_NAME})
+
+LOCATION_STATE_RE = re.compile(r'USA,\s*([\w\s\-]+),')
+CITY_STATE_RE = re.compile(r'([\w\s\-]+),\s*(\w+)')
+LOCATION_ID_RE = re.compile(r'@(\d+)')
+
+# Search results naming part of a place rather than the place itself
+LOCATION_PENALTY_TERMS = ('historical', 'district', 'north', 'south', 'east', 'west')
+
+@functools.lru_cache(maxsize=1024)
+def normalize_state(state):
+    """Return the two-letter abbreviation for a state name or abbreviation, or None.
+    
+    Exact names and abbreviations are one dict lookup; the few inputs that
+    need the containment scan are remembered.
+    """
+    lower = state.strip().lower()
+    abbr = STATE_LOOKUP.get(lower)
+    if abbr:
+        return abbr
+    
+    # Fall back to the closest containing match, e.g. 'Maryland (MD)'
+    for state_name, abbr in STATE_NAME_TO_ABBR.items():
+        if state_name in lower or (len(lower) > 3 and lower in state_name):
+            return abbr
+    return None
+
+def parse_location_rows(html_content):
+    """Return (location_id, location_name, row_text) for every result on a search page."""
+    from bs4 import BeautifulSoup
+    
+    soup = BeautifulSoup(html_content, 'html.parser')
+    location_rows = []
+    
+    # Skip the header row
+    for row in soup.select('table tr')[1:]:
+        location_link = row.select_one('a')
+        if not location_link:
+            continue
+    
+        location_id_match = LOCATION_ID_RE.search(location_link.get('href', ''))
+        if location_id_match:
+            location_rows.append((location_id_match.group(1), location_link.text.strip(), row.text.strip()))
+    return location_rows
 
 def search_location(city_name):
     """Search for a location on timeanddate.com and return its ID."""
     # Parse city and state from input
-    city_state_pattern = r'([\w\s\-]+),\s*(\w+)'
-    match = re.search(city_state_pattern, city_name)
+    match = CITY_STATE_RE.search(city_name)
     
     if match:
         city = match.group(1).strip()
         state = match.group(2).strip()
-        print(f"Searching for city: {city}, state: {state}")
+        log.info("Searching for city: %s, state: %s", city, state)
     else:
         city = city_name
         state = None
-        print(f"Searching for: {city}")
+        log.info("Searching for: %s", city)
     
-    search_url = f"https://www.timeanddate.com/weather/?query={quote(city_name)}+usa"
+    search_url = f"{TIMEANDDATE_BASE_URL}/weather/?query={quote(city_name)}+usa"
     
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(search_url, headers=headers)
+        response = http_get(search_url)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        location_rows = parse_in_pool('locations', response.text)
         
-        # Find all search result rows
-        location_rows = soup.select('table tr')
-        
-        if not location_rows or len(location_rows) <= 1:  # Account for header row
-            print(f"No matching locations found for '{city_name}'")
+        if not location_rows:
+            log.warning("No matching locations found for '%s'", city_name)
             return None
         
         usa_locations = []
         
-        # Define state abbreviations dictionary
-        state_abbr_to_name = {
-            'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
-            'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
-            'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
-            'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
-            'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri',
-            'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey',
-            'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
-            'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
-            'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
-            'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
-            'DC': 'District of Columbia'
-        }
-        
         # Get state full name if abbreviation was provided
-        state_full = state_abbr_to_name.get(state.upper(), state) if state else None
+        state_full = STATE_ABBR_TO_NAME.get(state.upper(), state) if state else None
+        state_upper = state.upper() if state else None
+        city_lower = city.lower()
         
-        # Skip the header row
-        for row in location_rows[1:]:
-            location_link = row.select_one('a')
-            if not location_link:
+        for location_id, location_name, location_text in location_rows:
+            # Only consider USA locations
+            if 'USA' not in location_text:
                 continue
-                
-            href = location_link.get('href', '')
-            location_id_match = re.search(r'@(\d+)', href)
             
-            if location_id_match:
-                location_id = location_id_match.group(1)
-                location_name = location_link.text.strip()
-                location_text = row.text.strip()
-                
-                # Only consider USA locations
-                if 'USA' not in location_text:
-                    continue
-                
-                # Calculate a match score
-                score = 0
-                
-                # Check for exact city name match
-                if city.lower() == location_name.lower():
-                    score += 100
-                # Check for city name contained in location name
-                elif city.lower() in location_name.lower():
+            # Calculate a match score
+            score = 0
+            
+            # Check for exact city name match
+            name_lower = location_name.lower()
+            exact = city_lower == name_lower
+            if exact:
+                score += 100
+            # Check for city name contained in location name
+            elif city_lower in name_lower:
+                score += 50
+            else:
+                continue  # Skip if city name not found at all
+            
+            # If state is provided, check for state match
+            if state:
+                # Try to match state abbreviation or full name
+                if state_upper in location_text or (state_full and state_full in location_text):
                     score += 50
                 else:
-                    continue  # Skip if city name not found at all
-                
-                # If state is provided, check for state match
-                if state:
-                    # Try to match state abbreviation or full name
-                    if state.upper() in location_text or (state_full and state_full in location_text):
-                        score += 50
-                    else:
-                        score -= 20  # Penalize if state doesn't match
-                
-                # Additional bonus for location that is exactly the city (not a district/area)
-                if location_name.lower() == city.lower():
-                    score += 30
-                
-                # Penalty for locations with "historical", "district", etc.
-                lower_text = location_text.lower()
-                if any(term in lower_text for term in ['historical', 'district', 'north', 'south', 'east', 'west']):
-                    score -= 10
-                
-                usa_locations.append({
-                    'id': location_id,
-                    'name': location_name,
-                    'full_text': location_text,
-                    'score': score
-                })
+                    score -= 20  # Penalize if state doesn't match
+            
+            # Additional bonus for location that is exactly the city (not a district/area)
+            if exact:
+                score += 30
+            
+            # Penalty for locations with "historical", "district", etc.
+            lower_text = location_text.lower()
+            if any(term in lower_text for term in LOCATION_PENALTY_TERMS):
+                score -= 10
+            
+            usa_locations.append({
+                'id': location_id,
+                'name': location_name,
+                'full_text': location_text,
+                'score': score
+            })
         
         if not usa_locations:
-            print(f"No matching locations found in USA for '{city_name}'")
+            log.warning("No matching locations found in USA for '%s'", city_name)
             return None
         
         # Sort locations by score and get the highest
         usa_locations.sort(key=lambda x: x['score'], reverse=True)
         
         # Print top matches for debugging
-        print("\nTop location matches:")
+        log.info("\nTop location matches:")
         for i, loc in enumerate(usa_locations[:3]):
-            print(f"{i+1}. {loc['full_text']} (Score: {loc['score']})")
+            log.info("%d. %s (Score: %s)", i + 1, loc['full_text'], loc['score'])
         
         # Return the highest scored result's ID
         location_id = usa_locations[0]['id']
         location_name = usa_locations[0]['name']
-        print(f"\nSelected location: {location_name} (ID: {location_id})")
+        log.info("\nSelected location: %s (ID: %s)", location_name, location_id)
         return location_id, location_name, usa_locations[0]['full_text']
         
     except Exception as e:
-        print(f"Error searching for location: {e}")
+        log.warning("Error searching for location: %s", e)
+        return None
+
+# City -> timeanddate ID lookups rarely change, so keep them for a long time
+DEFAULT_LOCATION_TTL_DAYS = 90
+# New lookups are written to disk in batches of this many, and at exit
+LOCATION_FLUSH_ENTRIES = 50
+
+_location_cache = None
+_location_cache_unsaved = 0
+_location_cache_lock = threading.Lock()
+_location_cache_settings = {'ttl_days': DEFAULT_LOCATION_TTL_DAYS, 'refresh': False}
+
+def location_cache_path():
+    """Path of the on-disk location ID cache."""
+    return os.path.join(CACHE_DIR, 'locations.json')
+
+def configure_location_cache(ttl_days=None, refresh=None):
+    """Set the location cache TTL (in days) and whether to bypass cached entries."""
+    with _location_cache_lock:
+        if ttl_days is not None:
+            _location_cache_settings['ttl_days'] = float(ttl_days)
+        if refresh is not None:
+            _location_cache_settings['refresh'] = bool(refresh)
+
+def normalize_location_query(city_name):
+    """Normalize user input so 'Ocean City,MD' and 'ocean  city, md' share a cache key."""
+    parts = [' '.join(part.split()) for part in city_name.lower().split(',')]
+    return ', '.join(part for part in parts if part)
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and move it into place so readers never see partial files."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _load_location_cache():
+    """Load the location cache from disk once per process. Caller holds the lock."""
+    global _location_cache
+    if _location_cache is None:
+        try:
+            with open(location_cache_path()) as f:
+                _location_cache = json.load(f)
+        except (OSError, ValueError):
+            _location_cache = {}
+    return _location_cache
+
+def get_cached_location(city_name):
+    """Return the cached (location_id, location_name, full_text) for a query, or None."""
+    key = normalize_location_query(city_name)
+    with _location_cache_lock:
+        if _location_cache_settings['refresh']:
+            return None
+        entry = _load_location_cache().get(key)
+        ttl_seconds = _location_cache_settings['ttl_days'] * 86400
+    
+    if not entry or time.time() - entry['cached_at'] > ttl_seconds:
+        return None
+    return entry['location_id'], entry['location_name'], entry['full_text']
+
+def store_cached_location(city_name, location_result):
+    """Remember a search_location result for a query.
+    
+    The cache file is rewritten once every LOCATION_FLUSH_ENTRIES new
+    entries rather than on every one; save_location_cache writes the rest.
+    """
+    global _location_cache_unsaved
+    location_id, location_name, full_text = location_result
+    with _location_cache_lock:
+        cache = _load_location_cache()
+        cache[normalize_location_query(city_name)] = {
+            'location_id': location_id,
+            'location_name': location_name,
+            'full_text': full_text,
+            'cached_at': time.time()
+        }
+        _location_cache_unsaved += 1
+        if _location_cache_unsaved >= LOCATION_FLUSH_ENTRIES:
+            _save_location_cache()
+
+def save_location_cache():
+    """Persist location lookups that haven't been written yet."""
+    with _location_cache_lock:
+        if _location_cache_unsaved:
+            _save_location_cache()
+
+def _save_location_cache():
+    """Caller holds the lock."""
+    global _location_cache_unsaved
+    write_json_atomic(location_cache_path(), _load_location_cache())
+    _location_cache_unsaved = 0
+
+atexit.register(save_location_cache)
+
+def clear_location_cache(city_names=None):
+    """Drop cached locations - all of them, or just the given queries. Returns the count removed."""
+    with _location_cache_lock:
+        cache = _load_location_cache()
+        if city_names is None:
+            removed = len(cache)
+            cache.clear()
+        else:
+            keys = [normalize_location_query(name) for name in city_names]
+            removed = sum(1 for key in keys if cache.pop(key, None) is not None)
+        _save_location_cache()
+    return removed
+
+# Bundled gazetteer of coastal places, plus a local overlay of places found by the scraper
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.json')
+
+# Fuzzy gazetteer matches are for typos: a minimum trigram similarity (0-1) and
+# at most this many trigrams more or fewer than the query
+GAZETTEER_MIN_SIMILARITY = 0.6
+GAZETTEER_MAX_SIZE_DIFFERENCE = 2
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+_gazetteer_settings = {'enabled': True, 'path': GAZETTEER_PATH}
+
+def gazetteer_overlay_path():
+    """Path of the local gazetteer overlay that scraper results are written back to."""
+    return os.path.join(CACHE_DIR, 'gazetteer.json')
+
+def configure_gazetteer(enabled=None, path=None):
+    """Turn gazetteer lookups on or off, or point at a different bundled gazetteer file."""
+    global _gazetteer
+    with _gazetteer_lock:
+        if enabled is not None:
+            _gazetteer_settings['enabled'] = bool(enabled)
+        if path is not None:
+            _gazetteer_settings['path'] = path
+        _gazetteer = None
+
+def trigrams(text):
+    """Character trigrams of a normalized name, padded so prefixes weigh more."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def split_city_state(city_name):
+    """Split 'Ocean City, MD' into ('ocean city', 'MD'). The state is '' when missing and None when unknown."""
+    name, separator, state = city_name.rpartition(',')
+    if not separator or not state.strip():
+        return ' '.join((name or state).lower().split()), ''
+    return ' '.join(name.lower().split()), normalize_state(state)
+
+def _read_gazetteer_places(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get('places', [])
+    except (OSError, ValueError, AttributeError):
+        return []
+
+def _index_gazetteer_place(index, place):
+    """Add one place to the exact-name and trigram indexes."""
+    name = ' '.join(place['name'].lower().split())
+    grams = trigrams(name)
+    position = len(index['places'])
+    index['places'].append(place)
+    index['sizes'].append(len(grams))
+    # Later entries (the overlay) replace earlier ones with the same name and state
+    index['exact'][(name, place['state'])] = position
+    for gram in grams:
+        index['trigrams'].setdefault(gram, []).append(position)
+
+def _load_gazetteer():
+    """Build the gazetteer index once per cache directory. Caller holds the lock."""
+    global _gazetteer
+    overlay_path = gazetteer_overlay_path()
+    if _gazetteer is None or _gazetteer['overlay_path'] != overlay_path:
+        index = {'overlay_path': overlay_path, 'places': [], 'sizes': [],
+                 'exact': {}, 'trigrams': {}}
+        for place in _read_gazetteer_places(_gazetteer_settings['path']) + _read_gazetteer_places(overlay_path):
+            _index_gazetteer_place(index, place)
+        _gazetteer = index
+    return _gazetteer
+
+def _fuzzy_gazetteer_match(index, name, state):
+    """Best trigram match for a name in the given state, or None if nothing is close enough or the best is ambiguous."""
+    grams = trigrams(name)
+    shared = {}
+    for gram in grams:
+        for position in index['trigrams'].get(gram, ()):
+            shared[position] = shared.get(position, 0) + 1
+    
+    scored = []
+    for position, count in shared.items():
+        if index['places'][position]['state'] != state:
+            continue
+        if abs(index['sizes'][position] - len(grams)) > GAZETTEER_MAX_SIZE_DIFFERENCE:
+            continue
+        similarity = count / (len(grams) + index['sizes'][position] - count)
+        if similarity >= GAZETTEER_MIN_SIMILARITY:
+            scored.append((similarity, position))
+    if not scored:
+        return None
+    
+    scored.sort(reverse=True)
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        return None
+    return scored[0][1]
+
+def gazetteer_lookup(city_name):
+    """Return (location_id, location_name, full_text) for a city from the gazetteer, or None.
+    
+    Only queries with a state are answered: names like Ocean City or Long
+    Beach exist in several states, and the gazetteer can't tell which one a
+    bare name means, so those go to the search instead.
+    """
+    name, state = split_city_state(city_name)
+    if not name or not state:
+        return None
+    
+    with _gazetteer_lock:
+        if not _gazetteer_settings['enabled']:
+            return None
+        index = _load_gazetteer()
+        position = index['exact'].get((name, state))
+        if position is None:
+            position = _fuzzy_gazetteer_match(index, name, state)
+        place = index['places'][position] if position is not None else None
+    
+    if place is None:
+        count_event('gazetteer_misses')
+        return None
+    count_event('gazetteer_hits')
+    return place['location_id'], place['location_name'], place.get('full_text', place['location_name'])
+
+def add_gazetteer_place(location_result):
+    """Write a scraper result back into the gazetteer overlay so later lookups stay local."""
+    location_id, location_name, full_text = location_result
+    parts = [part.strip() for part in location_name.split(',')]
+    state = state_abbr_for_location(location_name)
+    if parts[0] != 'USA' or not state:
+        return
+    
+    place = {'name': parts[-1], 'state': state, 'location_id': location_id, 'location_name': location_name}
+    with _gazetteer_lock:
+        index = _load_gazetteer()
+        _index_gazetteer_place(index, place)
+        overlay = _read_gazetteer_places(index['overlay_path'])
+        overlay = [entry for entry in overlay if (entry['name'], entry['state']) != (place['name'], state)]
+        write_json_atomic(index['overlay_path'], {'places': overlay + [place]})
+
+def resolve_location(city_name):
+    """Return (location_id, location_name, full_text) for a city.
+    
+    Tries the location cache, then the gazetteer, and only scrapes the search
+    page when both miss.
+    """
+    cached = get_cached_location(city_name)
+    if cached:
+        log.info("Using cached location: %s (ID: %s)", cached[1], cached[0])
+        return cached
+    
+    place = gazetteer_lookup(city_name)
+    if place:
+        log.info("Using gazetteer location: %s (ID: %s)", place[1], place[0])
+        return place
+    
+    with stage('location_search'):
+        location_result = search_location(city_name)
+    if location_result:
+        store_cached_location(city_name, location_result)
+        add_gazetteer_place(location_result)
+    return location_result
+
+def prewarm_locations(city_names, concurrency=DEFAULT_CONCURRENCY):
+    """Resolve every city not already cached or in the gazetteer. Returns (already_cached, resolved, failed) lists."""
+    already_cached = [name for name in city_names if get_cached_location(name) or gazetteer_lookup(name)]
+    to_resolve = [name for name in city_names if name not in already_cached]
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(resolve_location, to_resolve))
+    
+    save_location_cache()
+    resolved = [name for name, result in zip(to_resolve, results) if result]
+    failed = [name for name, result in zip(to_resolve, results) if not result]
+    return already_cached, resolved, failed
+
+def read_city_list(path):
+    """Read city names from a file: one per line or '&'-separated, '#' starts a comment."""
+    city_names = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0]
+            city_names.extend(name.strip() for name in line.split('&') if name.strip())
+    return city_names
+
+def state_abbr_for_location(full_location):
+    """Get the state abbreviation from a timeanddate location text like 'USA, State, City'."""
+    # Extract state from full location text (format is typically "USA, State, City")
+    state_match = LOCATION_STATE_RE.search(full_location)
+    state = state_match.group(1).strip() if state_match else None
+    return normalize_state(state) if state else None
+
+# A request budget caps how many timeanddate.com requests one run, or any
+# rolling hour of runs, may make. Cities are planned in order of value; those
+# that don't fit are served their last-known forecast, or skipped if they have none.
+BUDGET_WINDOW_SECONDS = 3600
+# Forecasts this many TTLs old (or missing) are as urgent as it gets
+MAX_STALENESS = 4.0
+
+_budget_settings = {'per_run': None, 'per_hour': None, 'priorities': {}}
+_budget_lock = threading.Lock()
+# Requests made since the per-run budget was set, and the persisted state:
+# the hourly request log and per-city yields
+_schedule = {'spent': 0, 'state': None}
+
+def schedule_path():
+    """Path of the request log and per-city yield history."""
+    return os.path.join(CACHE_DIR, 'schedule.json')
+
+def configure_budget(per_run=None, per_hour=None, priorities=None):
+    """Set the request budget per run and per rolling hour (0 for no limit) and {city: weight} priorities.
+    
+    Setting per_run starts a new run, so nothing counts as spent against it yet.
+    """
+    with _budget_lock:
+        if per_run is not None:
+            _schedule['spent'] = 0
+        for name, value in (('per_run', per_run), ('per_hour', per_hour)):
+            if value is None:
+                continue
+            value = int(value)
+            if value < 0:
+                raise ValueError("Request budgets can't be negative")
+            _budget_settings[name] = value or None
+        if priorities is not None:
+            _budget_settings['priorities'] = {normalize_location_query(name): float(weight)
+                                              for name, weight in priorities.items()}
+
+def parse_priorities(text):
+    """Parse 'Ocean City, MD=3 & Virginia Beach, VA=0.5' into {city: weight}."""
+    priorities = {}
+    for item in text.split('&'):
+        if not item.strip():
+            continue
+        name, sep, weight = item.rpartition('=')
+        if not sep or not name.strip():
+            raise ValueError(f"Priority must look like CITY=WEIGHT: {item.strip()}")
+        priorities[name.strip()] = float(weight)
+    return priorities
+
+def budget_enabled():
+    with _budget_lock:
+        return bool(_budget_settings['per_run'] or _budget_settings['per_hour'])
+
+def _load_schedule_state():
+    """Load the schedule state from disk once per process. Caller holds the lock."""
+    if _schedule['state'] is None:
+        try:
+            with open(schedule_path()) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('requests', [])
+        state.setdefault('cities', {})
+        _schedule['state'] = state
+    return _schedule['state']
+
+def save_schedule_state():
+    """Persist the request log (last hour only) and per-city yields, if they were used."""
+    with _budget_lock:
+        state = _schedule['state']
+        if state is None:
+            return
+        cutoff = time.time() - BUDGET_WINDOW_SECONDS
+        state['requests'] = [entry for entry in state['requests'] if entry[0] > cutoff]
+        write_json_atomic(schedule_path(), state)
+
+def spend_request():
+    """Count one timeanddate.com request attempt, retries included, against the budget."""
+    second = int(time.time())
+    with _budget_lock:
+        _schedule['spent'] += 1
+        requests = _load_schedule_state()['requests']
+        # One log entry per second keeps the log short during a burst
+        if requests and requests[-1][0] == second:
+            requests[-1][1] += 1
+        else:
+            requests.append([second, 1])
+
+def note_city_yield(city_name, found):
+    """Remember whether a check of a city turned up any suitable periods."""
+    with _budget_lock:
+        cities = _load_schedule_state()['cities']
+        stats = cities.setdefault(normalize_location_query(city_name), {'checks': 0, 'hits': 0})
+        stats['checks'] += 1
+        stats['hits'] += bool(found)
+
+def requests_remaining():
+    """Requests the budget still allows right now, or None without a budget. Caller holds the lock."""
+    limits = []
+    if _budget_settings['per_run']:
+        limits.append(_budget_settings['per_run'] - _schedule['spent'])
+    if _budget_settings['per_hour']:
+        cutoff = time.time() - BUDGET_WINDOW_SECONDS
+        used = sum(count for at, count in _load_schedule_state()['requests'] if at > cutoff)
+        limits.append(_budget_settings['per_hour'] - used)
+    return max(0, min(limits)) if limits else None
+
+def budget_exhausted():
+    """True when there is a budget and nothing is left of it."""
+    with _budget_lock:
+        return requests_remaining() == 0
+
+def estimate_city_requests(city_name, now):
+    """(requests, staleness, has_forecast) for loading a city with the caches as they are.
+    
+    Staleness is the cached forecast's age in forecast TTLs, capped at
+    MAX_STALENESS, which is also used when nothing is cached.
+    """
+    location = get_cached_location(city_name) or gazetteer_lookup(city_name)
+    if location is None:
+        # A location search, then the forecast
+        return 2, MAX_STALENESS, False
+    
+    entry = load_forecast_entry(location[0])
+    with _forecast_cache_lock:
+        ttl_seconds = _forecast_cache_settings['ttl_minutes'] * 60
+        refresh = _forecast_cache_settings['refresh']
+    if entry is None:
+        return 1, MAX_STALENESS, False
+    age = now - entry['fetched_at']
+    if not refresh and age <= ttl_seconds:
+        return 0, 0.0, True
+    return 1, min(MAX_STALENESS, age / ttl_seconds) if ttl_seconds else MAX_STALENESS, True
+
+class RequestPlan:
+    """One scan's budget decision per city, and the cities it served stale or skipped.
+    
+    Every scan makes its own plan and passes it down to load_city_forecast,
+    so concurrent searches (as under --serve) never see each other's.
+    order is the city names in the order to process them.
+    """
+    def __init__(self, order, decisions=None):
+        self.order = order
+        self.decisions = decisions or {}
+        self.served_stale = {}
+        self.skipped = []
+        self.lock = threading.Lock()
+    
+    def decision(self, city_name):
+        """'fetch', 'cached', 'stale', 'skip', or None for a city the plan didn't cover."""
+        return self.decisions.get(city_name)
+    
+    def note_stale(self, city_name, age_minutes):
+        with self.lock:
+            self.served_stale[city_name] = age_minutes
+    
+    def note_skipped(self, city_name):
+        with self.lock:
+            self.skipped.append(city_name)
+
+def plan_requests(city_names):
+    """Order cities by value and decide which may use the network under the request budget.
+    
+    A city's score is its user priority, times how often it has yielded
+    suitable periods (smoothed, so unseen cities start at one half), times
+    how stale its cached forecast is. Going down that order, cities get the
+    requests they need while the budget lasts; after that, ones with a cached
+    forecast are served it as-is and the rest are skipped. Returns a
+    RequestPlan (keeping the given order when there is no budget).
+    """
+    if not budget_enabled():
+        return RequestPlan(city_names)
+    
+    now = time.time()
+    estimates = {name: estimate_city_requests(name, now) for name in dict.fromkeys(city_names)}
+    
+    with _budget_lock:
+        yields = _load_schedule_state()['cities']
+        priorities = _budget_settings['priorities']
+        
+        def score(name):
+            key = normalize_location_query(name)
+            stats = yields.get(key, {})
+            quality = (stats.get('hits', 0) + 1) / (stats.get('checks', 0) + 2)
+            return priorities.get(key, 1.0) * quality * estimates[name][1]
+        
+        ordered = sorted(estimates, key=score, reverse=True)
+        remaining = requests_remaining()
+    
+    planned = 0
+    decisions = {}
+    for name in ordered:
+        requests_needed, _, has_forecast = estimates[name]
+        if requests_needed == 0:
+            decisions[name] = 'cached'
+        elif requests_needed <= remaining:
+            decisions[name] = 'fetch'
+            remaining -= requests_needed
+            planned += requests_needed
+        else:
+            decisions[name] = 'stale' if has_forecast else 'skip'
+    
+    deferred = sum(1 for decision in decisions.values() if decision in ('stale', 'skip'))
+    log.info("Request budget: %d requests planned for %d cities, %d deferred", planned, len(decisions), deferred)
+    position = {name: i for i, name in enumerate(ordered)}
+    return RequestPlan(sorted(city_names, key=position.__getitem__), decisions)
+
+def note_forecast_age(city_name, location_id, plan):
+    """Record the city in the plan as served stale if its forecast is older than the TTL. Returns the age in minutes."""
+    entry = load_forecast_entry(location_id)
+    if entry is None:
+        return None
+    age_minutes = (time.time() - entry['fetched_at']) / 60
+    with _forecast_cache_lock:
+        ttl_minutes = _forecast_cache_settings['ttl_minutes']
+    if age_minutes > ttl_minutes and plan is not None:
+        plan.note_stale(city_name, age_minutes)
+    return age_minutes
+
+def budget_report(plan=None):
+    """What a plan did: {'limited', 'spent', 'remaining', 'served_stale': {city: age_minutes}, 'skipped'}."""
+    limited = budget_enabled()
+    with _budget_lock:
+        spent = _schedule['spent']
+        remaining = requests_remaining()
+    with plan.lock if plan is not None else contextlib.nullcontext():
+        return {
+            'limited': limited,
+            'spent': spent,
+            'remaining': remaining,
+            'served_stale': dict(plan.served_stale) if plan is not None else {},
+            'skipped': list(plan.skipped) if plan is not None else [],
+        }
+
+def load_city_forecast(city_name, plan=None):
+    """Resolve a city and get its parsed forecast.
+    
+    Returns a dict with the city as entered, its location ID and name, state
+    abbreviation, forecast_data and the forecast's age, or None if any step
+    failed or the request budget has no room for the city. plan is the
+    scan's RequestPlan, if it made one.
+    """
+    def skip():
+        log.info("Skipping %s: request budget used up and no forecast cached", city_name)
+        count_event('budget_skipped')
+        if plan is not None:
+            plan.note_skipped(city_name)
+    
+    decision = plan.decision(city_name) if plan is not None else None
+    # Retries can spend more than was planned; once it's gone, serve what we have
+    if decision in ('fetch', None) and budget_exhausted():
+        decision = 'stale'
+    if decision == 'skip':
+        skip()
+        return None
+    
+    if decision == 'stale':
+        location_result = get_cached_location(city_name) or gazetteer_lookup(city_name)
+        if not location_result:
+            skip()
+            return None
+    else:
+        location_result = resolve_location(city_name)
+    
+    if not location_result:
+        log.warning("Could not find location for %s", city_name)
+        return None
+        
+    location_id, city, full_location = location_result
+    state_abbr = state_abbr_for_location(full_location)
+    
+    forecast_data = get_forecast_data(location_id, offline=decision == 'stale')
+    
+    if forecast_data is None and decision == 'stale':
+        skip()
+        return None
+    
+    if forecast_data is None:
+        log.warning("Could not fetch forecast for %s", city_name)
+        return None
+    
+    if not forecast_data:
+        log.warning("No forecast data found for %s", city_name)
         return None
+    
+    log.info("Found forecast data for %d days", len(forecast_data))
+    
+    return {
+        'city_name': city_name,
+        'location_id': location_id,
+        'location_name': city,
+        'state_abbr': state_abbr,
+        'forecast_data': forecast_data,
+        'forecast_hash': cached_forecast_hash(location_id),
+        'forecast_age_minutes': note_forecast_age(city_name, location_id, plan)
+    }
+
+def build_period_result(city_forecast, period, period_num, max_price):
+    """Build the result record for one suitable period, including its Expedia URL."""
+    start_date = period['start_date']
+    end_date = period['end_date']
+    
+    # Calculate the number of days in the range
+    days_in_range = (end_date - start_date).days + 1
+    
+    if 'days_off_needed' in period:
+        days_off_needed = period['days_off_needed']
+        holidays = period['holidays']
+    else:
+        calendar = calendar_index(start_date, end_date)
+        days_off_needed = calendar.days_off_needed(start_date.toordinal(), end_date.toordinal())
+        holidays = calendar.holidays_near(start_date.toordinal(), end_date.toordinal())
+    
+    # Count rainy days
+    days = as_forecast_table(period['days'])
+    rainy_days = days.rainy_days()
+    total_days = len(days)
+    
+    with stage('url_generation'):
+        expedia_url = generate_expedia_url(
+            city_forecast['location_name'], city_forecast['state_abbr'], start_date, end_date, max_price
+        )
+    
+    return {
+        'city': city_forecast['city_name'],
+        'location_id': city_forecast['location_id'],
+        'period_num': period_num,
+        'start_date': start_date,
+        'end_date': end_date,
+        'start_date_str': start_date.strftime("%a, %b %d"),
+        'end_date_str': end_date.strftime("%a, %b %d"),
+        'nights': days_in_range - 1,
+        'days': days_in_range,
+        'rainy_days': rainy_days,
+        'expedia_url': expedia_url,
+        'rain_percentage': (rainy_days / total_days) * 100,
+        'days_off_needed': days_off_needed,
+        'holidays': holidays,
+        'days_data': days  # Include full days data for summary
+    }
+
+def format_forecast_lines(days):
+    """One line per day of a period, for the progress log."""
+    forecast_details = []
+    for day in days:
+        date_str = day['date'].strftime("%a, %b %d")
+        temp_str = ""
+        if day['temp_high'] and day['temp_low']:
+            temp_str = f" [{day['temp_high']}°F / {day['temp_low']}°F]"
+        
+        # Add rain probability if available
+        rain_prob_str = ""
+        if day['rain_probability'] is not None:
+            rain_prob_str = f" (Rain: {day['rain_probability']}%)"
+            
+        forecast_details.append(f"   - {date_str}{temp_str}: {day['description']}{rain_prob_str}")
+    return forecast_details
 
-def process_city(city_name, trip_length, max_price):
+def process_city(city_name, trip_length, max_price, plan=None):
     """Process a single city to find suitable travel periods."""
-    print(f"\n{'='*50}")
-    print(f"ANALYZING: {city_name}")
-    print(f"{'='*50}")
+    with city_metrics(city_name):
+        return list(iter_city_periods(city_name, trip_length, max_price, plan))
+
+def iter_city_periods(city_name, trip_length, max_price, plan=None):
+    """Yield a result record for each suitable period in a city as soon as it is built."""
+    log.info("\n%s\nANALYZING: %s\n%s", '='*50, city_name, '='*50)
+    
+    city_forecast = load_city_forecast(city_name, plan)
+    if not city_forecast:
+        return
+    
+    yield from iter_forecast_periods(city_forecast, trip_length, max_price)
+
+def iter_forecast_periods(city_forecast, trip_length, max_price):
+    """Yield a result record for each suitable period in an already loaded city forecast."""
+    city_name = city_forecast['city_name']
+    log.info("Finding %s-night periods with good weather that are weekend-adjacent...", format_trip_lengths(trip_length))
+    with stage('window_search'):
+        suitable_periods = find_suitable_periods(city_forecast['forecast_data'], trip_length)
+    
+    note_city_yield(city_name, bool(suitable_periods))
+    if not suitable_periods:
+        log.info("No suitable periods found in the 14-day forecast for %s", city_name)
+        return
+    
+    log.info("\nSuitable periods for %s:", city_name)
+    for i, period in enumerate(suitable_periods, 1):
+        result = build_period_result(city_forecast, period, i, max_price)
+        
+        log.info("%d. %s to %s (%d nights / %d days)", i, result['start_date_str'], result['end_date_str'],
+                 result['nights'], result['days'])
+        log.info("   Rain: %d/%d days (%.1f%%)", result['rainy_days'], len(period['days']), result['rain_percentage'])
+        if log.isEnabledFor(logging.INFO):
+            for line in format_forecast_lines(result['days_data']):
+                log.info("%s", line)
+        log.info("   Hotel search: %s", result['expedia_url'])
+        
+        yield result
+
+def fetch_forecast_page(location_id, etag=None, last_modified=None, stream=False):
+    """Request the 14-day forecast page, conditionally if validators are given.
+    
+    Returns the response (status 200 or 304), or None if the request failed.
+    With stream=True the body has not been read yet.
+    """
+    return fetch_conditional(f"{TIMEANDDATE_BASE_URL}/weather/@{location_id}/ext", etag, last_modified, stream)
+
+def fetch_conditional(forecast_url, etag=None, last_modified=None, stream=False):
+    """GET a forecast URL, conditionally if validators are given (see fetch_forecast_page)."""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    
+    response = None
+    try:
+        response = http_get(forecast_url, headers=headers, stream=stream)
+        response.raise_for_status()
+        return response
+    except Exception as e:
+        log.warning("Error fetching weather forecast: %s", e)
+        if response is not None:
+            response.close()
+        return None
+
+FORECAST_TABLE_START_RE = re.compile(r'<table\b[^>]*\bid=["\']?wt-ext\b', re.I)
+
+STREAM_CHUNK_SIZE = 8192
+
+def read_forecast_stream(response):
+    """Read a streamed forecast page only until the wt-ext table has closed.
+    
+    The connection is closed as soon as '</table>' follows the forecast
+    table, so scripts, ads and footer markup are never downloaded. If the
+    table never closes, the whole body is read. Returns the HTML read so far.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    html_content = ''
+    table_start = -1
+    table_closed = False
+    body_exhausted = True
     
-    location_result = search_location(city_name)
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            # Re-scan a little of the previous text in case a tag spans chunks
+            search_from = max(0, len(html_content) - 64)
+            html_content += decoder.decode(chunk)
+            
+            if table_start < 0:
+                start_match = FORECAST_TABLE_START_RE.search(html_content, search_from)
+                if not start_match:
+                    continue
+                table_start = start_match.start()
+                search_from = table_start
+            
+            if html_content.find('</table>', max(search_from, table_start)) >= 0:
+                table_closed = True
+                # The table can close in the last chunk, after the whole body
+                # arrived; check before leaving the loop closes the stream
+                body_exhausted = response.raw.closed
+                break
+        
+        bytes_read = response.raw.tell()
+        if not table_closed or body_exhausted:
+            html_content += decoder.decode(b'', final=True)
+    finally:
+        response.close()
+    
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit():
+        stopped_early = table_closed and bytes_read < int(content_length)
+    else:
+        stopped_early = table_closed and not body_exhausted
+    count_event('stream_bytes_read', bytes_read)
+    count_event('bytes_downloaded', bytes_read)
+    if stopped_early:
+        count_event('stream_early_stops')
+        if content_length.isdigit():
+            bytes_saved = int(content_length) - bytes_read
+            count_event('stream_bytes_saved', bytes_saved)
+            log.info("Stopped download after forecast table: read %d of %s bytes (saved %d)", bytes_read, content_length, bytes_saved)
+        else:
+            log.info("Stopped download after forecast table: read %d bytes", bytes_read)
+    elif table_closed:
+        log.info("Forecast table ended with the page, read full page (%d bytes)", bytes_read)
+    else:
+        log.info("Forecast table end not found, read full page (%d bytes)", bytes_read)
+    
+    return html_content
+
+def get_weather_forecast(location_id):
+    """Get the 14-day weather forecast for a given location ID."""
+    response = fetch_forecast_page(location_id)
+    return response.text if response is not None else None
+
+MONTH_NUMBERS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+RAIN_TERMS = ('rain', 'shower', 'drizzle', 'thunderstorm', 'precipitation', 'sprinkle', 'tstorm')
+
+# Precompiled patterns for the targeted forecast table parser
+FORECAST_TABLE_RE = re.compile(r'<table\b[^>]*\bid=["\']?wt-ext\b[^>]*>(.*?)</table>', re.S | re.I)
+TBODY_RE = re.compile(r'<tbody\b[^>]*>(.*?)</tbody>', re.S | re.I)
+ROW_RE = re.compile(r'<tr\b[^>]*>(.*?)</tr>', re.S | re.I)
+TH_RE = re.compile(r'<th\b[^>]*>(.*?)</th>', re.S | re.I)
+TD_RE = re.compile(r'<td\b[^>]*>(.*?)</td>', re.S | re.I)
+TD_OPEN_RE = re.compile(r'<td\b', re.I)
+DAY_SPAN_RE = re.compile(r'<span\b[^>]*\bclass=["\']?(?:[^"\'>]*\s)?smaller\b[^>]*>(.*?)</span>', re.S | re.I)
+DATE_AFTER_BR_RE = re.compile(r'<br/?>([\w]+)\s+(\d{1,2})')
+WEATHER_IMG_RE = re.compile(r'<img\b[^>]*\bclass=["\']?mtt\b[^>]*>', re.I)
+TITLE_ATTR_RE = re.compile(r'\btitle=(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+TEMP_RE = re.compile(r'(\d+)\s*/\s*(\d+)')
+
+def build_forecast_day(day_of_week, month_abbr, day, weather_desc, cell_texts, today):
+    """Turn the fields extracted from one forecast row into a forecast day dict.
+    
+    `cell_texts` is the text of every td in the row, in order. Returns None if
+    the month abbreviation is not recognised.
+    """
+    # Extract temperature from the first cell showing degrees
+    temp_high = None
+    temp_low = None
+    for text in cell_texts:
+        if '°F' in text or '°C' in text:
+            temp_match = TEMP_RE.search(text.strip())
+            if temp_match:
+                temp_high = int(temp_match.group(1))
+                temp_low = int(temp_match.group(2))
+            break
+    
+    has_rain = False
+    rain_probability = None
+    
+    if weather_desc:
+        # Check weather description for rain-related terms
+        lower_desc = weather_desc.lower()
+        has_rain = any(term in lower_desc for term in RAIN_TERMS)
+    
+    if len(cell_texts) >= 8:  # The chance column is usually 8th td
+        chance_text = cell_texts[7].strip()
+        if chance_text and chance_text != '0%':
+            try:
+                chance = int(chance_text.replace('%', ''))
+                rain_probability = chance
+                if chance > 20:  # If more than 20% chance, consider it might rain
+                    has_rain = True
+            except ValueError:
+                pass
+    
+    year = today.year
+    # Handle December to January transition
+    if month_abbr == 'Jan' and today.month == 12:
+        year += 1
+    
+    month_num = MONTH_NUMBERS.get(month_abbr, None)
+    if not month_num:
+        log.warning("Invalid month abbreviation: %s", month_abbr)
+        return None
+    
+    return {
+        'date': datetime.date(year, month_num, day),
+        'day_of_week': day_of_week,
+        'description': weather_desc,
+        'has_rain': has_rain,
+        'rain_probability': rain_probability,
+        'temp_high': temp_high,
+        'temp_low': temp_low
+    }
+
+def cell_text(inner_html):
+    """Text content of a cell's inner HTML, like BeautifulSoup's .text."""
+    return html.unescape(TAG_RE.sub('', inner_html))
+
+def parse_forecast_fast(html_content):
+    """Parse the forecast with precompiled patterns over just the wt-ext table.
+    
+    Skips building a document tree for the whole page. Returns None when the
+    markup does not look like the layout this parser knows, so the caller can
+    fall back to the full BeautifulSoup parse.
+    """
+    table_match = FORECAST_TABLE_RE.search(html_content)
+    if not table_match:
+        return None
+    
+    table_html = table_match.group(1)
+    # Nested tables or comments would confuse the non-nesting patterns
+    if '<table' in table_html.lower() or '<!--' in table_html:
+        return None
+    
+    tbody_match = TBODY_RE.search(table_html)
+    rows = ROW_RE.findall(tbody_match.group(1) if tbody_match else table_html)
+    if not rows:
+        return None
+    
+    log.info("Found %d rows in forecast table", len(rows))
+    count_event('rows_parsed', len(rows))
+    
+    today = datetime.datetime.now()
+    forecast_data = []
+    
+    for row in rows:
+        th_match = TH_RE.search(row)
+        if not th_match:
+            continue
+        
+        th_html = th_match.group(1)
+        day_span = DAY_SPAN_RE.search(th_html)
+        if not day_span:
+            continue
+        
+        month_day_match = DATE_AFTER_BR_RE.search(th_html)
+        if not month_day_match:
+            return None
+        
+        # Every cell must have been closed explicitly or the column indexes shift
+        cells = TD_RE.findall(row)
+        if len(cells) != len(TD_OPEN_RE.findall(row)):
+            return None
+        
+        weather_desc = ""
+        weather_img = WEATHER_IMG_RE.search(row)
+        if weather_img:
+            title_match = TITLE_ATTR_RE.search(weather_img.group(0))
+            if title_match:
+                weather_desc = html.unescape(next(group for group in title_match.groups() if group is not None))
+        
+        try:
+            day_data = build_forecast_day(
+                cell_text(day_span.group(1)).strip(),
+                month_day_match.group(1),
+                int(month_day_match.group(2)),
+                weather_desc,
+                [cell_text(cell) for cell in cells],
+                today
+            )
+        except Exception as e:
+            log.warning("Error processing row: %s", e)
+            continue
+        
+        if day_data:
+            forecast_data.append(day_data)
+    
+    log.info("Successfully extracted %d days of forecast data", len(forecast_data))
+    return forecast_data
+
+def parse_forecast(html_content):
+    """Parse the HTML content to extract weather forecast data."""
+    forecast_data = parse_forecast_fast(html_content)
+    if forecast_data is not None:
+        return forecast_data
+    
+    log.info("Forecast table layout not recognised, using full HTML parse")
+    return parse_forecast_soup(html_content)
+
+def parse_forecast_soup(html_content):
+    """Parse the forecast by building a BeautifulSoup tree of the whole page."""
+    from bs4 import BeautifulSoup
+    
+    soup = BeautifulSoup(html_content, 'html.parser')
+    forecast_data = []
+    
+    # Find the forecast table - using the id from the sample file
+    forecast_table = soup.find('table', id='wt-ext')
+    
+    if not forecast_table:
+        log.warning("Could not find forecast table with id 'wt-ext'")
+        # Try alternative selectors
+        forecast_table = soup.select_one('table.zebra, table.fw, table.tb-wt')
+        if not forecast_table:
+            log.warning("Could not find any forecast tables")
+            return []
+    
+    # Find all rows in the tbody section of the table
+    tbody = forecast_table.find('tbody')
+    if not tbody:
+        log.info("No tbody found in forecast table")
+        rows = forecast_table.find_all('tr')
+    else:
+        rows = tbody.find_all('tr')
+    
+    if not rows:
+        log.warning("No rows found in forecast table")
+        return []
+    
+    log.info("Found %d rows in forecast table", len(rows))
+    count_event('rows_parsed', len(rows))
+    
+    today = datetime.datetime.now()
+    
+    for row in rows:
+        try:
+            # Skip rows that don't have a th element (header cells with dates)
+            th = row.find('th')
+            if not th:
+                continue
+            
+            # Extract the day of week and date from the th
+            day_span = th.find('span', class_='smaller')
+            if not day_span:
+                continue
+                
+            day_of_week = day_span.text.strip()
+            
+            # The month and day are in the text after the span
+            # This captures text like "May 10" that follows the span and br tag
+            date_text = th.decode_contents()
+            month_day_match = DATE_AFTER_BR_RE.search(date_text)
+            
+            if not month_day_match:
+                log.warning("Could not extract month/day from: %s", date_text)
+                continue
+                
+            month_abbr = month_day_match.group(1)
+            day = int(month_day_match.group(2))
+            
+            # Find the weather description from img title attribute
+            weather_img = row.find('img', class_='mtt')
+            weather_desc = ""
+            if weather_img and weather_img.has_attr('title'):
+                weather_desc = weather_img['title']
+            
+            cell_texts = [cell.text for cell in row.find_all('td')]
+            day_data = build_forecast_day(day_of_week, month_abbr, day, weather_desc, cell_texts, today)
+            if day_data:
+                forecast_data.append(day_data)
+            
+        except Exception as e:
+            log.warning("Error processing row: %s", e)
+            continue
+    
+    log.info("Successfully extracted %d days of forecast data", len(forecast_data))
+    return forecast_data
+
+# Forecasts are kept column-wise: a 14-day forecast is a handful of small
+# arrays instead of 14 dicts, and a period is an offset and length into them.
+FORECAST_FIELDS = ('date', 'day_of_week', 'description', 'has_rain', 'rain_probability', 'temp_high', 'temp_low')
+
+# Stands in for a missing rain probability or temperature in the int16 columns
+MISSING_VALUE = -32768
+
+# Descriptions and weekday names repeat endlessly across cities, so each is stored once
+_text_table = []
+_text_ids = {}
+_text_table_lock = threading.Lock()
+
+def intern_text(text):
+    """Index of a string in the shared text table, adding it on first use."""
+    index = _text_ids.get(text)
+    if index is None:
+        with _text_table_lock:
+            index = _text_ids.get(text)
+            if index is None:
+                _text_table.append(text)
+                index = _text_ids[text] = len(_text_table) - 1
+    return index
+
+def pack_value(value):
+    return MISSING_VALUE if value is None else value
+
+def unpack_value(value):
+    return None if value == MISSING_VALUE else value
+
+def pack_forecast(forecast_data):
+    """Forecast days as plain tuples, which pickle far smaller than dicts of dates."""
+    return [(day['date'].toordinal(), day['day_of_week'], day['description'], day['has_rain'],
+             day['rain_probability'], day['temp_high'], day['temp_low']) for day in forecast_data]
+
+class ForecastColumns:
+    """The column arrays of one city's forecast, shared by every view of it."""
+    __slots__ = ('ordinals', 'weekdays', 'descriptions', 'rain_mask', 'rain_probability', 'temp_high', 'temp_low')
+    
+    def __init__(self, rows):
+        self.ordinals = array('l')
+        self.weekdays = array('H')
+        self.descriptions = array('H')
+        self.rain_probability = array('h')
+        self.temp_high = array('h')
+        self.temp_low = array('h')
+        # Bit i is set when day i has rain
+        self.rain_mask = 0
+        for i, (ordinal, day_of_week, description, has_rain, rain_probability, temp_high, temp_low) in enumerate(rows):
+            self.ordinals.append(ordinal)
+            self.weekdays.append(intern_text(day_of_week))
+            self.descriptions.append(intern_text(description))
+            self.rain_probability.append(pack_value(rain_probability))
+            self.temp_high.append(pack_value(temp_high))
+            self.temp_low.append(pack_value(temp_low))
+            if has_rain:
+                self.rain_mask |= 1 << i
+
+class ForecastDay(Mapping):
+    """One day of a ForecastTable, read like the day dicts the parsers build."""
+    __slots__ = ('columns', 'index')
+    
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+    
+    def __getitem__(self, key):
+        columns = self.columns
+        i = self.index
+        if key == 'date':
+            return datetime.date.fromordinal(columns.ordinals[i])
+        if key == 'day_of_week':
+            return _text_table[columns.weekdays[i]]
+        if key == 'description':
+            return _text_table[columns.descriptions[i]]
+        if key == 'has_rain':
+            return bool(columns.rain_mask >> i & 1)
+        if key == 'rain_probability':
+            return unpack_value(columns.rain_probability[i])
+        if key == 'temp_high':
+            return unpack_value(columns.temp_high[i])
+        if key == 'temp_low':
+            return unpack_value(columns.temp_low[i])
+        raise KeyError(key)
+    
+    def __iter__(self):
+        return iter(FORECAST_FIELDS)
+    
+    def __len__(self):
+        return len(FORECAST_FIELDS)
+    
+    def __repr__(self):
+        return repr(dict(self))
+
+class ForecastTable(Sequence):
+    """A city's forecast stored column-wise, or a contiguous run of its days.
+    
+    Indexing returns ForecastDay views and slicing returns another table over
+    the same columns, so a period costs an offset and a length, not a copy.
+    """
+    __slots__ = ('columns', 'start', 'length')
+    
+    def __init__(self, columns, start=0, length=None):
+        self.columns = columns
+        self.start = start
+        self.length = len(columns.ordinals) - start if length is None else length
+    
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a table from pack_forecast tuples."""
+        return cls(ForecastColumns(rows))
+    
+    @classmethod
+    def from_days(cls, days):
+        """Build a table from day dicts (or views of another table)."""
+        return cls.from_rows(pack_forecast(days))
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                raise ValueError("ForecastTable slices must be contiguous")
+            return ForecastTable(self.columns, self.start + start, max(0, stop - start))
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("forecast day out of range")
+        return ForecastDay(self.columns, self.start + index)
+    
+    def rainy_days(self):
+        """Number of days with rain, counted from the bitmask."""
+        return bin(self.columns.rain_mask >> self.start & ((1 << self.length) - 1)).count('1')
+    
+    def index_of(self, date):
+        """Position of a date in this table. Raises ValueError if it is missing."""
+        ordinals = self.columns.ordinals
+        index = ordinals.index(date.toordinal(), self.start, self.start + self.length)
+        return index - self.start
+    
+    def __repr__(self):
+        return f"ForecastTable({list(map(dict, self))!r})"
+
+def as_forecast_table(forecast_data):
+    """Return forecast_data as a ForecastTable, converting a list of day dicts."""
+    if isinstance(forecast_data, ForecastTable):
+        return forecast_data
+    return ForecastTable.from_days(forecast_data)
+
+# Parsing is pure-Python CPU work, so large scans can spread it over a process
+# pool. Pages are sent in batches to amortize the IPC round trip per task.
+DEFAULT_PARSE_BATCH_SIZE = 8
+PARSE_BATCH_WAIT = 0.005
+
+_parse_pool = None
+_parse_queue = None
+_parse_pool_lock = threading.Lock()
+_parse_pool_settings = {'workers': 0, 'batch_size': DEFAULT_PARSE_BATCH_SIZE}
+
+def unpack_forecast(packed):
+    """Inverse of pack_forecast."""
+    return ForecastTable.from_rows(packed)
+
+def parse_page(kind, html_content):
+    """Parse one page in this process: a 'forecast' page or a 'locations' search page."""
+    if kind == 'forecast':
+        return parse_forecast(html_content)
+    return parse_location_rows(html_content)
+
+def parse_batch(jobs):
+    """Worker entry point: parse (kind, html) jobs and return (rows_parsed, compact result) pairs."""
+    results = []
+    for kind, html_content in jobs:
+        rows_before = _event_counters.get('rows_parsed', 0)
+        parsed = parse_page(kind, html_content)
+        if kind == 'forecast':
+            parsed = pack_forecast(parsed)
+        results.append((_event_counters.get('rows_parsed', 0) - rows_before, parsed))
+    return results
+
+def configure_parse_pool(workers=None, batch_size=None):
+    """Set how many worker processes parse pages (0 parses in the calling thread)
+    and how many pages go to a worker at once. The pool is kept for later runs."""
+    with _parse_pool_lock:
+        if workers is not None:
+            workers = max(0, int(workers))
+            if workers != _parse_pool_settings['workers']:
+                _shutdown_parse_pool()
+            _parse_pool_settings['workers'] = workers
+        if batch_size is not None:
+            _parse_pool_settings['batch_size'] = max(1, int(batch_size))
+
+def shutdown_parse_pool():
+    """Stop the worker processes, if any."""
+    with _parse_pool_lock:
+        _shutdown_parse_pool()
+
+atexit.register(shutdown_parse_pool)
+
+def _shutdown_parse_pool():
+    """Caller holds the lock."""
+    global _parse_pool, _parse_queue
+    if _parse_pool is not None:
+        _parse_queue.put(None)
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = _parse_queue = None
+
+def _start_parse_pool():
+    """Create the pool and its batching thread on first use. Caller holds the lock."""
+    global _parse_pool, _parse_queue
+    if _parse_pool is None:
+        # Imported here because multiprocessing is slow to load and most runs never need it
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        # Spawned workers don't inherit the locks held by our request threads
+        _parse_pool = ProcessPoolExecutor(max_workers=_parse_pool_settings['workers'],
+                                          mp_context=multiprocessing.get_context('spawn'))
+        _parse_queue = queue.Queue()
+        threading.Thread(target=_dispatch_parse_batches, args=(_parse_pool, _parse_queue),
+                         name='parse-dispatch', daemon=True).start()
+    return _parse_queue
+
+def _dispatch_parse_batches(pool, jobs):
+    """Group queued parse jobs into batches and hand them to the pool."""
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        batch = [job]
+        # Wait briefly for other threads' pages so one task carries several
+        deadline = time.monotonic() + PARSE_BATCH_WAIT
+        while len(batch) < _parse_pool_settings['batch_size']:
+            try:
+                job = jobs.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if job is None:
+                jobs.put(None)
+                break
+            batch.append(job)
+    
+        try:
+            future = pool.submit(parse_batch, [(kind, html_content) for kind, html_content, _ in batch])
+        except RuntimeError as e:
+            for _, _, waiter in batch:
+                waiter.set_exception(e)
+            continue
+        future.add_done_callback(lambda future, batch=batch: _resolve_parse_batch(future, batch))
+
+def _resolve_parse_batch(future, batch):
+    """Pass each page's result (or the batch's failure) back to the thread waiting on it."""
+    try:
+        results = future.result()
+    except BaseException as e:
+        for _, _, waiter in batch:
+            waiter.set_exception(e)
+        return
+    for (_, _, waiter), result in zip(batch, results):
+        waiter.set_result(result)
+
+def parse_in_pool(kind, html_content):
+    """Parse a 'forecast' or 'locations' page, in the process pool when one is configured.
+    
+    If a worker fails the pool is shut down and parsing continues in-process.
+    """
+    waiter = Future()
+    # Queue the job under the lock, so a shutdown can't slip in ahead of it and
+    # leave it behind the dispatcher's stop sentinel with nobody to answer it
+    with _parse_pool_lock:
+        if not _parse_pool_settings['workers']:
+            waiter = None
+        else:
+            _start_parse_pool().put((kind, html_content, waiter))
+            pool = _parse_pool
+    if waiter is None:
+        return parse_page(kind, html_content)
+    
+    try:
+        rows_parsed, parsed = waiter.result()
+    except Exception as e:
+        with _parse_pool_lock:
+            # A job cancelled by a shutdown or pool change isn't a worker failure
+            if _parse_pool is pool:
+                log.warning("Parse worker failed (%s), parsing in-process from now on", e)
+                _shutdown_parse_pool()
+                _parse_pool_settings['workers'] = 0
+        return parse_page(kind, html_content)
+    
+    count_event('pool_pages_parsed')
+    if rows_parsed:
+        count_event('rows_parsed', rows_parsed)
+    return unpack_forecast(parsed) if kind == 'forecast' else parsed
+
+# The 14-day outlook only changes a few times a day
+DEFAULT_FORECAST_TTL_MINUTES = 60
+DEFAULT_FORECAST_CACHE_SIZE = 500
+
+_forecast_memory = OrderedDict()
+_forecast_cache_lock = threading.Lock()
+_forecast_cache_settings = {
+    'ttl_minutes': DEFAULT_FORECAST_TTL_MINUTES,
+    'max_entries': DEFAULT_FORECAST_CACHE_SIZE,
+    'refresh': False,
+    'stream': False
+}
+
+def forecast_cache_dir():
+    """Directory holding one cached forecast file per location ID."""
+    return os.path.join(CACHE_DIR, 'forecasts')
+
+def configure_forecast_cache(ttl_minutes=None, max_entries=None, refresh=None, stream=None):
+    """Set the forecast cache TTL, size bound, whether to bypass fresh entries,
+    and whether forecast pages are streamed and cut off after the table."""
+    with _forecast_cache_lock:
+        if ttl_minutes is not None:
+            _forecast_cache_settings['ttl_minutes'] = float(ttl_minutes)
+        if max_entries is not None:
+            _forecast_cache_settings['max_entries'] = max(1, int(max_entries))
+        if refresh is not None:
+            _forecast_cache_settings['refresh'] = bool(refresh)
+        if stream is not None:
+            _forecast_cache_settings['stream'] = bool(stream)
+
+def forecast_to_json(forecast_data):
+    """Convert forecast_data to JSON-safe dicts (dates as ISO strings)."""
+    return [dict(day, date=day['date'].isoformat()) for day in forecast_data]
+
+def forecast_from_json(days):
+    """Inverse of forecast_to_json, as a ForecastTable."""
+    return ForecastTable.from_days([dict(day, date=datetime.date.fromisoformat(day['date'])) for day in days])
+
+def load_forecast_entry(location_id):
+    """Return the cached entry for a location (memory first, then disk), or None."""
+    with _forecast_cache_lock:
+        entry = _forecast_memory.get(location_id)
+        if entry is not None:
+            _forecast_memory.move_to_end(location_id)
+            return entry
+    
+    path = os.path.join(forecast_cache_dir(), f"{location_id}.json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        entry['forecast_data'] = forecast_from_json(entry['forecast_data'])
+    except (OSError, ValueError, KeyError):
+        return None
+    
+    remember_forecast_entry(location_id, entry)
+    return entry
+
+def remember_forecast_entry(location_id, entry):
+    """Put an entry in the in-memory LRU, evicting the least recently used beyond the size bound."""
+    with _forecast_cache_lock:
+        _forecast_memory[location_id] = entry
+        _forecast_memory.move_to_end(location_id)
+        while len(_forecast_memory) > _forecast_cache_settings['max_entries']:
+            _forecast_memory.popitem(last=False)
+
+def store_forecast_entry(location_id, entry):
+    """Save an entry in memory and on disk, then trim the disk cache to its size bound."""
+    remember_forecast_entry(location_id, entry)
+    
+    cache_dir = forecast_cache_dir()
+    on_disk = dict(entry, forecast_data=forecast_to_json(entry['forecast_data']))
+    write_json_atomic(os.path.join(cache_dir, f"{location_id}.json"), on_disk)
+    
+    # Evict the least recently written files beyond the bound
+    with _forecast_cache_lock:
+        max_entries = _forecast_cache_settings['max_entries']
+        try:
+            files = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json')]
+        except OSError:
+            return
+        if len(files) <= max_entries:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def forecast_table_hash(html_content):
+    """Digest of just the forecast table, so page furniture changes don't count as a new forecast."""
+    table_match = FORECAST_TABLE_RE.search(html_content)
+    content = table_match.group(0) if table_match else html_content
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def cached_forecast_hash(location_id):
+    """Table digest of a location's cached forecast, or None."""
+    entry = load_forecast_entry(location_id)
+    return entry.get('table_hash') if entry else None
+
+# Forecast providers turn a source of forecasts into the normalized
+# forecast_data shape (a ForecastTable). Any provider can back up another:
+# when the primary has not answered by its own p95 latency, the same request
+# is hedged to the backup and whichever answers first is used.
+DEFAULT_HEDGE_PERCENTILE = 95
+# Until a provider has this many timed responses, hedge after DEFAULT_HEDGE_DELAY
+HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.05
+
+# Latency buckets grow by 25% from 1 ms, topping out past REQUEST_TIMEOUT
+LATENCY_BUCKET_BOUNDS = tuple(0.001 * 1.25 ** i for i in range(50))
+
+class LatencyHistogram:
+    """Response times of one provider in log-spaced buckets, for percentile estimates."""
+    __slots__ = ('counts', 'total', 'failures', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        index = bisect.bisect_left(LATENCY_BUCKET_BOUNDS, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def percentile(self, percent):
+        """Upper bound in seconds of the bucket holding the given percentile, or None if empty."""
+        with self.lock:
+            if not self.total:
+                return None
+            wanted = self.total * percent / 100
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= wanted:
+                    break
+        return LATENCY_BUCKET_BOUNDS[min(index, len(LATENCY_BUCKET_BOUNDS) - 1)]
+
+class ForecastProvider(ABC):
+    """A source of 14-day forecasts for timeanddate.com location IDs.
+    
+    Subclasses give the URL for a location and turn the body into a
+    ForecastTable; fetching (conditional, retried, per-host limited) and
+    latency tracking are shared.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyHistogram()
+
+    @abstractmethod
+    def url(self, location_id):
+        """The URL to request a location's forecast from."""
+
+    def fetch(self, location_id, etag=None, last_modified=None, stream=False):
+        """Request a location's forecast, timing it. Returns the response or None."""
+        start = time.perf_counter()
+        response = fetch_conditional(self.url(location_id), etag, last_modified, stream)
+        if response is None:
+            self.latency.record_failure()
+        else:
+            self.latency.record(time.perf_counter() - start)
+        return response
+
+    def read(self, response, stream=False):
+        """The body of a response returned by fetch, closing it (which frees a streamed request's host slot)."""
+        try:
+            return response.text
+        finally:
+            response.close()
+
+    def table_hash(self, content):
+        """Digest of the forecast itself, to spot pages that changed around an unchanged forecast."""
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @abstractmethod
+    def parse(self, content):
+        """Turn a body into a ForecastTable (empty if it holds no forecast)."""
+
+class TimeanddateProvider(ForecastProvider):
+    """The timeanddate.com /ext page, or a mirror of it at another base URL."""
+    def __init__(self, name='timeanddate', base_url=None):
+        super().__init__(name)
+        self.base_url = base_url
+
+    def url(self, location_id):
+        # Without a base URL, follow TIMEANDDATE_BASE_URL (which --replay repoints)
+        return f"{self.base_url or TIMEANDDATE_BASE_URL}/weather/@{location_id}/ext"
+
+    def read(self, response, stream=False):
+        return read_forecast_stream(response) if stream else response.text
+
+    def table_hash(self, content):
+        return forecast_table_hash(content)
+
+    def parse(self, content):
+        return as_forecast_table(parse_in_pool('forecast', content))
+
+class JsonForecastProvider(ForecastProvider):
+    """A service answering with forecast_data as JSON, in the forecast cache's on-disk format.
+    
+    url_template holds a {location_id} placeholder, e.g.
+    'http://127.0.0.1:8001/forecast/{location_id}.json'.
+    """
+    def __init__(self, name, url_template):
+        super().__init__(name)
+        self.url_template = url_template
+
+    def url(self, location_id):
+        return self.url_template.format(location_id=location_id)
+
+    def parse(self, content):
+        try:
+            return forecast_from_json(json.loads(content))
+        except (ValueError, TypeError, KeyError) as e:
+            log.warning("Invalid forecast JSON from %s: %s", self.name, e)
+            return ForecastTable.from_days([])
+
+_providers = {'timeanddate': TimeanddateProvider()}
+_provider_settings = {'primary': 'timeanddate', 'backup': None, 'percentile': DEFAULT_HEDGE_PERCENTILE}
+_provider_lock = threading.Lock()
+
+def register_provider(provider):
+    """Make a provider available to configure_providers by its name."""
+    with _provider_lock:
+        _providers[provider.name] = provider
+
+def provider_from_spec(name, spec):
+    """A provider for a --mirror/--backup-provider value.
+    
+    A spec containing '{location_id}' is a JSON forecast service; anything
+    else is the base URL of a timeanddate.com mirror.
+    """
+    if '{location_id}' in spec:
+        return JsonForecastProvider(name, spec)
+    return TimeanddateProvider(name, spec.rstrip('/'))
+
+def configure_providers(primary=None, backup=None, percentile=None):
+    """Pick the registered providers to fetch from and the hedge percentile.
+    
+    backup='' turns hedging off. Raises ValueError for an unknown provider
+    name or a percentile outside 1-100.
+    """
+    with _provider_lock:
+        for name in (primary, backup):
+            if name and name not in _providers:
+                raise ValueError(f"Unknown forecast provider: {name}")
+        if percentile is not None:
+            percentile = float(percentile)
+            if not 0 < percentile <= 100:
+                raise ValueError("Hedge percentile must be between 1 and 100")
+            _provider_settings['percentile'] = percentile
+        if primary:
+            _provider_settings['primary'] = primary
+        if backup is not None:
+            _provider_settings['backup'] = backup or None
+
+def hedge_delay(provider, percentile):
+    """Seconds to wait for provider before hedging: its observed percentile latency."""
+    if provider.latency.total < HEDGE_MIN_SAMPLES:
+        return DEFAULT_HEDGE_DELAY
+    return max(HEDGE_MIN_DELAY, provider.latency.percentile(percentile))
+
+def provider_validators(provider, validators):
+    """The (etag, last_modified) to send provider: its own from validators, else none.
+    
+    validators is (issuer, etag, last_modified) from the cached entry; an
+    ETag from one provider means nothing to another.
+    """
+    if validators is None or validators[0] != provider.name:
+        return None, None
+    return validators[1], validators[2]
+
+def start_fetch(provider, location_id, validators, stream):
+    """Run provider.fetch on its own thread, on behalf of the calling city. Returns a Future."""
+    future = Future()
+    city = current_city()
+    record = getattr(_context, 'record', None)
+    
+    def run():
+        _context.city = city
+        _context.record = record
+        try:
+            future.set_result(provider.fetch(location_id, *provider_validators(provider, validators), stream))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, name=f"fetch-{provider.name}", daemon=True).start()
+    return future
+
+def discard_response(future):
+    """Close the response of a request that lost its race, once it arrives."""
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        future.result().close()
+
+def fetch_forecast(location_id, validators=None, stream=False):
+    """Fetch a forecast from the primary provider, hedging to the backup if it is slow.
+    
+    The backup is asked too once the primary has taken longer than its p95
+    (or other configured percentile) latency, or straight away if the
+    primary fails. validators is the cached (issuer, etag, last_modified),
+    sent only to the provider that issued them. Returns (provider, response)
+    for the first usable answer, or (provider, None) when every provider failed.
+    """
+    with _provider_lock:
+        primary = _providers[_provider_settings['primary']]
+        backup_name = _provider_settings['backup']
+        backup = _providers[backup_name] if backup_name else None
+        percentile = _provider_settings['percentile']
+    
+    if backup is None or backup is primary:
+        return primary, primary.fetch(location_id, *provider_validators(primary, validators), stream)
+    
+    futures = {start_fetch(primary, location_id, validators, stream): primary}
+    done, _ = wait(futures, timeout=hedge_delay(primary, percentile))
+    if not done:
+        count_event('hedged_requests')
+        log.info("%s is slow for location ID %s, also asking %s", primary.name, location_id, backup.name)
+    # Nothing to wait for on a failed primary; a late one may still win below
+    if not done or next(iter(done)).result() is None:
+        futures[start_fetch(backup, location_id, validators, stream)] = backup
+    
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            response = future.result()
+            if response is None:
+                continue
+            for loser in pending:
+                loser.add_done_callback(discard_response)
+            provider = futures[future]
+            if provider is backup:
+                count_event('hedge_wins')
+            return provider, response
+    return primary, None
+
+def provider_stats():
+    """Return {name: {'responses', 'failures', 'p50_ms', 'p95_ms'}} for providers that were used."""
+    with _provider_lock:
+        providers = list(_providers.values())
+    stats = {}
+    for provider in providers:
+        latency = provider.latency
+        if not latency.total and not latency.failures:
+            continue
+        p50 = latency.percentile(50)
+        p95 = latency.percentile(95)
+        stats[provider.name] = {
+            'responses': latency.total,
+            'failures': latency.failures,
+            'p50_ms': round(p50 * 1000) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000) if p95 is not None else None,
+        }
+    return stats
+
+def get_forecast_data(location_id, offline=False):
+    """Return parsed forecast_data for a location, using the forecast cache.
+    
+    Fresh cache entries are returned without touching the network. Stale ones
+    are revalidated with If-None-Match/If-Modified-Since, and a 304 (or a new
+    page whose forecast table hashes the same) reuses the cached parse. If the
+    fetch fails, or with offline=True, a stale entry is returned as the
+    last-known forecast. Returns None if there is no forecast to return.
+    """
+    entry = load_forecast_entry(location_id)
+    
+    with _forecast_cache_lock:
+        ttl_seconds = _forecast_cache_settings['ttl_minutes'] * 60
+        refresh = _forecast_cache_settings['refresh']
+        stream = _forecast_cache_settings['stream']
+    
+    if entry and not refresh and time.time() - entry['fetched_at'] <= ttl_seconds:
+        count_event('forecast_cache_hits')
+        log.info("Using cached forecast for location ID %s", location_id)
+        return entry['forecast_data']
+    
+    if offline:
+        if not entry:
+            return None
+        count_event('forecast_served_stale')
+        log.info("Using last-known forecast for location ID %s without revalidating", location_id)
+        return entry['forecast_data']
+    
+    log.info("Fetching 14-day forecast for location ID %s...", location_id)
+    with stage('forecast_download'):
+        if entry:
+            # Entries cached before there were providers all came from timeanddate.com
+            validators = (entry.get('provider', 'timeanddate'), entry.get('etag'), entry.get('last_modified'))
+            provider, response = fetch_forecast(location_id, validators, stream=stream)
+        else:
+            provider, response = fetch_forecast(location_id, stream=stream)
+    
+    if response is None:
+        if not entry:
+            return None
+        count_event('forecast_served_stale')
+        log.warning("Could not refresh forecast for location ID %s, using the last-known one", location_id)
+        return entry['forecast_data']
+    
+    if response.status_code == 304 and entry:
+        response.close()
+        count_event('forecast_cache_revalidated')
+        log.info("Forecast unchanged since last fetch, reusing cached data")
+        entry = dict(entry, fetched_at=time.time())
+        store_forecast_entry(location_id, entry)
+        # The source still stands by this forecast, which the history should show
+        record_forecast_history(location_id, entry['fetched_at'], entry['forecast_data'])
+        return entry['forecast_data']
+    
+    with stage('forecast_download'):
+        html_content = provider.read(response, stream)
+    
+    table_hash = provider.table_hash(html_content)
+    if entry and entry.get('table_hash') == table_hash:
+        # The page changed (ads, timestamps) but the forecast table did not
+        count_event('forecast_unchanged')
+        log.info("Forecast table unchanged since last fetch, reusing cached data")
+        entry = dict(entry, fetched_at=time.time(), provider=provider.name, etag=response.headers.get('ETag'),
+                     last_modified=response.headers.get('Last-Modified'))
+        store_forecast_entry(location_id, entry)
+        record_forecast_history(location_id, entry['fetched_at'], entry['forecast_data'])
+        return entry['forecast_data']
+    
+    count_event('forecast_cache_misses')
+    log.info("Parsing forecast data...")
+    with stage('parse'):
+        forecast_data = provider.parse(html_content)
+    
+    if forecast_data:
+        fetched_at = time.time()
+        store_forecast_entry(location_id, {
+            'location_id': location_id,
+            'fetched_at': fetched_at,
+            'provider': provider.name,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'table_hash': table_hash,
+            'forecast_data': forecast_data
+        })
+        record_forecast_history(location_id, fetched_at, forecast_data)
+    return forecast_data
+
+# Every newly parsed forecast can be appended to a SQLite history, so we can
+# see how the outlook for a window has drifted across successive fetches
+DEFAULT_HISTORY_FETCHES = 5
+HISTORY_FLUSH_ROWS = 5000
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecast_fetches (
+    location_id TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (location_id, fetched_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS forecast_days (
+    location_id TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    description TEXT,
+    has_rain INTEGER NOT NULL,
+    rain_probability INTEGER,
+    temp_high INTEGER,
+    temp_low INTEGER,
+    PRIMARY KEY (location_id, date, fetched_at)
+) WITHOUT ROWID;
+"""
+
+_history_connection = None
+_history_pending = []
+_history_lock = threading.Lock()
+_history_settings = {'enabled': False, 'path': None, 'fetches': DEFAULT_HISTORY_FETCHES}
+
+def history_path():
+    """Path of the forecast history database."""
+    return _history_settings['path'] or os.path.join(CACHE_DIR, 'history.sqlite')
+
+def configure_forecast_history(enabled=None, path=None, fetches=None):
+    """Turn history recording on or off, move the database, or set how many past fetches trends cover."""
+    with _history_lock:
+        if path is not None and path != _history_settings['path']:
+            _close_history()
+            _history_settings['path'] = path
+        if enabled is not None:
+            _history_settings['enabled'] = bool(enabled)
+        if fetches is not None:
+            _history_settings['fetches'] = max(1, int(fetches))
+
+def history_enabled():
+    return _history_settings['enabled']
+
+def _history_db():
+    """Open the database and create its tables on first use. Caller holds the lock."""
+    global _history_connection
+    if _history_connection is None:
+        import sqlite3
+        
+        path = history_path()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(HISTORY_SCHEMA)
+        _history_connection = connection
+    return _history_connection
+
+def _close_history():
+    """Caller holds the lock."""
+    global _history_connection
+    if _history_connection is not None:
+        _history_connection.close()
+        _history_connection = None
+
+def record_forecast_history(location_id, fetched_at, forecast_data):
+    """Queue a parsed forecast for the history store; rows are written in bulk."""
+    if not _history_settings['enabled']:
+        return
+    columns = forecast_data.columns
+    rows = [(location_id, columns.ordinals[i], fetched_at, _text_table[columns.descriptions[i]],
+             columns.rain_mask >> i & 1, unpack_value(columns.rain_probability[i]),
+             unpack_value(columns.temp_high[i]), unpack_value(columns.temp_low[i]))
+            for i in range(forecast_data.start, forecast_data.start + len(forecast_data))]
+    with _history_lock:
+        _history_pending.extend(rows)
+        if len(_history_pending) < HISTORY_FLUSH_ROWS:
+            return
+    flush_forecast_history()
+
+def flush_forecast_history():
+    """Write every queued forecast to the history store in one transaction."""
+    import sqlite3
+    
+    with _history_lock:
+        if not _history_pending:
+            return
+        rows = list(_history_pending)
+        _history_pending.clear()
+        try:
+            connection = _history_db()
+            with connection:
+                connection.executemany("INSERT OR IGNORE INTO forecast_fetches VALUES (?, ?)",
+                                       sorted({(row[0], row[2]) for row in rows}))
+                connection.executemany("INSERT OR REPLACE INTO forecast_days VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            log.warning("Could not write forecast history: %s", e)
+            return
+    count_event('history_rows_written', len(rows))
+
+def recent_fetch_times(location_id, fetches=None):
+    """Times of the last `fetches` recorded forecasts for a location, oldest first."""
+    flush_forecast_history()
+    with _history_lock:
+        rows = _history_db().execute(
+            "SELECT fetched_at FROM forecast_fetches WHERE location_id = ? ORDER BY fetched_at DESC LIMIT ?",
+            (location_id, fetches or _history_settings['fetches'])
+        ).fetchall()
+    return [fetched_at for fetched_at, in reversed(rows)]
+
+def window_rain_trend(location_id, start_date, end_date, fetches=None):
+    """Average rain chance over a window in each recent fetch that covered all of it, oldest first."""
+    fetch_times = recent_fetch_times(location_id, fetches)
+    if not fetch_times:
+        return []
+    with _history_lock:
+        rows = _history_db().execute(
+            "SELECT fetched_at, AVG(COALESCE(rain_probability, 0)) FROM forecast_days "
+            "WHERE location_id = ? AND date BETWEEN ? AND ? AND fetched_at >= ? "
+            "GROUP BY fetched_at HAVING COUNT(*) = ? ORDER BY fetched_at",
+            (location_id, start_date.toordinal(), end_date.toordinal(), fetch_times[0],
+             (end_date - start_date).days + 1)
+        ).fetchall()
+    return [(fetched_at, round(average, 1)) for fetched_at, average in rows]
+
+def attach_forecast_trends(all_results):
+    """Store each result's window_rain_trend averages under result['rain_trend']."""
+    import sqlite3
+    
+    try:
+        for result in all_results:
+            trend = window_rain_trend(result['location_id'], result['start_date'], result['end_date'])
+            result['rain_trend'] = [average for _, average in trend]
+    except sqlite3.Error as e:
+        log.warning("Could not read forecast history: %s", e)
+    return all_results
+
+def nth_weekday(year, month, weekday, n):
+    """The nth (1-based, or -1 for last) given weekday of a month."""
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+def federal_holidays(year):
+    """US federal holidays of a year as {observed date: name}.
+    
+    Holidays falling on a Saturday are observed the Friday before and those on
+    a Sunday the Monday after.
+    """
+    fixed = {
+        datetime.date(year, 1, 1): "New Year's Day",
+        datetime.date(year, 6, 19): "Juneteenth",
+        datetime.date(year, 7, 4): "Independence Day",
+        datetime.date(year, 11, 11): "Veterans Day",
+        datetime.date(year, 12, 25): "Christmas Day",
+    }
+    holidays = {
+        nth_weekday(year, 1, 0, 3): "Martin Luther King Jr. Day",
+        nth_weekday(year, 2, 0, 3): "Presidents' Day",
+        nth_weekday(year, 5, 0, -1): "Memorial Day",
+        nth_weekday(year, 9, 0, 1): "Labor Day",
+        nth_weekday(year, 10, 0, 2): "Columbus Day",
+        nth_weekday(year, 11, 3, 4): "Thanksgiving Day",
+    }
+    for date, name in fixed.items():
+        if date.weekday() == 5:
+            date -= datetime.timedelta(days=1)
+        elif date.weekday() == 6:
+            date += datetime.timedelta(days=1)
+        holidays[date] = name
+    return holidays
+
+# Extra days either side of a requested span, so nearby forecasts reuse one index
+CALENDAR_MARGIN_DAYS = 31
+
+class CalendarIndex:
+    """Weekends, federal holidays and PTO days over a span of dates, as bitmasks.
+    
+    Bit i of each mask is the day with ordinal first_ordinal + i, so checking
+    a window against days off is a shift and a mask rather than a date loop.
+    Methods take day ordinals.
+    """
+    __slots__ = ('first_ordinal', 'last_ordinal', 'weekends', 'holidays', 'pto', 'days_off', 'holiday_names')
+    
+    def __init__(self, first_date, last_date, pto_days=(), include_holidays=True):
+        self.first_ordinal = first_date.toordinal()
+        self.last_ordinal = last_date.toordinal()
+        self.weekends = 0
+        self.holidays = 0
+        self.pto = 0
+        self.holiday_names = {}
+        
+        for i in range(self.last_ordinal - self.first_ordinal + 1):
+            if datetime.date.fromordinal(self.first_ordinal + i).weekday() >= 5:
+                self.weekends |= 1 << i
+        if include_holidays:
+            for year in range(first_date.year, last_date.year + 1):
+                for date, name in federal_holidays(year).items():
+                    if first_date <= date <= last_date:
+                        self.holidays |= 1 << (date.toordinal() - self.first_ordinal)
+                        self.holiday_names[date.toordinal()] = name
+        for date in pto_days:
+            if first_date <= date <= last_date:
+                self.pto |= 1 << (date.toordinal() - self.first_ordinal)
+        self.days_off = self.weekends | self.holidays | self.pto
+    
+    def covers(self, first_ordinal, last_ordinal):
+        return self.first_ordinal <= first_ordinal and last_ordinal <= self.last_ordinal
+    
+    def span(self, mask, first_ordinal, last_ordinal):
+        """The bits of a mask for days first_ordinal..last_ordinal inclusive."""
+        return mask >> (first_ordinal - self.first_ordinal) & ((1 << (last_ordinal - first_ordinal + 1)) - 1)
+    
+    def is_day_off(self, ordinal):
+        return bool(self.days_off >> (ordinal - self.first_ordinal) & 1)
+    
+    def touches_day_off(self, start_ordinal, end_ordinal):
+        """Whether a stay, or the day before or after it, is a weekend, holiday or PTO day."""
+        return self.span(self.days_off, start_ordinal - 1, end_ordinal + 1) != 0
+    
+    def days_off_needed(self, start_ordinal, end_ordinal):
+        """Working days in a stay, i.e. days off it would cost."""
+        return end_ordinal - start_ordinal + 1 - bin(self.span(self.days_off, start_ordinal, end_ordinal)).count('1')
+    
+    def holidays_near(self, start_ordinal, end_ordinal):
+        """Names of the holidays in a stay or the day either side of it."""
+        if not self.span(self.holidays, start_ordinal - 1, end_ordinal + 1):
+            return []
+        return [self.holiday_names[ordinal] for ordinal in range(start_ordinal - 1, end_ordinal + 2)
+                if ordinal in self.holiday_names]
+
+_calendar = None
+_calendar_lock = threading.Lock()
+_calendar_settings = {'pto_days': frozenset(), 'holidays': True}
+
+def configure_calendar(pto_days=None, holidays=None):
+    """Set extra days off (an iterable of dates) and whether federal holidays count."""
+    global _calendar
+    with _calendar_lock:
+        if pto_days is not None:
+            _calendar_settings['pto_days'] = frozenset(pto_days)
+        if holidays is not None:
+            _calendar_settings['holidays'] = bool(holidays)
+        _calendar = None
+
+def calendar_index(first_date, last_date):
+    """The shared CalendarIndex, rebuilt only when a span falls outside what it covers."""
+    global _calendar
+    first_ordinal = first_date.toordinal() - 1
+    last_ordinal = last_date.toordinal() + 1
+    calendar = _calendar
+    if calendar is not None and calendar.covers(first_ordinal, last_ordinal):
+        return calendar
+    with _calendar_lock:
+        calendar = _calendar
+        if calendar is None or not calendar.covers(first_ordinal, last_ordinal):
+            if calendar is not None:
+                first_ordinal = min(first_ordinal, calendar.first_ordinal)
+                last_ordinal = max(last_ordinal, calendar.last_ordinal)
+            calendar = _calendar = CalendarIndex(
+                datetime.date.fromordinal(first_ordinal - CALENDAR_MARGIN_DAYS),
+                datetime.date.fromordinal(last_ordinal + CALENDAR_MARGIN_DAYS),
+                _calendar_settings['pto_days'], _calendar_settings['holidays']
+            )
+    return calendar
+
+def parse_pto_days(value):
+    """Parse '2026-05-26,2026-07-01..2026-07-03' into a list of dates, raising ValueError for anything else."""
+    if not isinstance(value, str):
+        raise ValueError("PTO days must be a string of dates")
+    days = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('..')
+        first = datetime.date.fromisoformat(first.strip())
+        last = datetime.date.fromisoformat(last.strip()) if last else first
+        days.extend(first + datetime.timedelta(days=offset) for offset in range((last - first).days + 1))
+    return days
+
+def format_trip_lengths(trip_length):
+    """Human-readable trip length(s), e.g. '2' or '1/2/3'."""
+    if isinstance(trip_length, (int, str)):
+        return str(trip_length)
+    return '/'.join(str(length) for length in sorted(trip_length))
+
+# No stay can be longer than the 14-day outlook it has to fit in
+MAX_TRIP_LENGTH = 14
+
+def parse_trip_lengths(value):
+    """Parse trip lengths in nights from '2', '1-3' or '1,2,4' into a sorted list.
+    
+    Raises ValueError unless every length is between 1 and MAX_TRIP_LENGTH.
+    """
+    lengths = set()
+    for part in str(value).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        low, sep, high = part.partition('-')
+        try:
+            low = int(low) if sep else int(part)
+            high = int(high) if sep else low
+        except ValueError:
+            raise ValueError(f"Invalid trip length: {value}") from None
+        # Check the bounds before expanding, so a huge range costs nothing
+        if low < 1 or high > MAX_TRIP_LENGTH:
+            raise ValueError(f"Trip lengths must be 1 to {MAX_TRIP_LENGTH} nights: {value}")
+        lengths.update(range(low, high + 1))
+    if not lengths:
+        raise ValueError(f"Invalid trip length: {value}")
+    return sorted(lengths)
+
+def find_suitable_periods(forecast_data, trip_length, order='date'):
+    """Find date ranges of specified length that meet weather criteria and touch days off.
+    
+    Days off are weekends, federal holidays and configured PTO days (see
+    configure_calendar), so a stay next to Memorial Day counts like one next
+    to a weekend.
+    
+    Args:
+        forecast_data: ForecastTable, or a list of daily forecast dictionaries
+        trip_length: Number of NIGHTS to stay (n nights = n+1 days), or an
+            iterable of night counts to search for all of them in one pass
+        order: 'date' for start date then length, or 'days_off' to put the
+            stays that cost the fewest working days first
+    
+    Returns:
+        List of suitable periods with their start and end dates, the working
+        days they need off ('days_off_needed') and any holidays they touch.
+        Each period's 'days' is a ForecastTable view.
+    """
+    suitable_periods = []
+    
+    if isinstance(trip_length, (int, str)):
+        trip_lengths = [int(trip_length)]
+    else:
+        trip_lengths = sorted({int(length) for length in trip_length})
+    
+    # For n nights, we need n+1 days
+    days_needed_options = [length + 1 for length in trip_lengths]
+    forecast_data = as_forecast_table(forecast_data)
+    num_days = len(forecast_data)
+    
+    # Read the columns directly rather than building a day view per lookup.
+    # Missing probabilities are a negative sentinel, so they pass the <= 30 checks like 0 does.
+    columns = forecast_data.columns
+    offset = forecast_data.start
+    ordinals = columns.ordinals[offset:offset + num_days]
+    dates = list(map(datetime.date.fromordinal, ordinals))
+    rain_probability = columns.rain_probability[offset:offset + num_days]
+    
+    # rainy_prefix[i] = rainy days among the first i days, so any window's count is one subtraction
+    rainy_prefix = [0]
+    rain_mask = columns.rain_mask >> offset
+    for i in range(num_days):
+        rainy_prefix.append(rainy_prefix[-1] + (rain_mask >> i & 1))
+    
+    count_event('windows_evaluated', sum(max(0, num_days - days_needed + 1) for days_needed in days_needed_options))
+    if not num_days:
+        return suitable_periods
+    calendar = calendar_index(dates[0], dates[-1])
+    
+    # Check each possible start date once, for every requested length
+    for i in range(num_days):
+        start_date = dates[i]
+        # Check if rain on first or last day is ≤ 30%
+        if rain_probability[i] > 30:
+            continue
+        
+        for days_needed in days_needed_options:
+            last = i + days_needed - 1
+            if last >= num_days:
+                break
+            
+            # Check criteria:
+            # 1. Less than half the days have rain
+            # 2. Both departure and arrival have ≤ 30% rain probability
+            # 3. Is weekend-adjacent
+            rainy_days = rainy_prefix[last + 1] - rainy_prefix[i]
+            end_day_rain_prob = rain_probability[last]
+            end_date = dates[last]
+            
+            if (rainy_days < days_needed / 2 and  # Less than half the days have rain
+                end_day_rain_prob <= 30 and       # ≤ 30% chance on arrival
+                calendar.touches_day_off(ordinals[i], ordinals[last])):  # Next to a weekend, holiday or PTO
+                suitable_periods.append({
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'days': ForecastTable(columns, offset + i, days_needed),
+                    'days_off_needed': calendar.days_off_needed(ordinals[i], ordinals[last]),
+                    'holidays': calendar.holidays_near(ordinals[i], ordinals[last])
+                })
+    
+    if order == 'days_off':
+        suitable_periods.sort(key=lambda period: period['days_off_needed'])
+    return suitable_periods
+
+# Default criteria for the ranking engine. The thresholds match find_suitable_periods.
+DEFAULT_RANKING_SETTINGS = {
+    'max_rain_probability': 30,   # Max % chance of rain on arrival and departure day
+    'max_rainy_fraction': 0.5,    # Rainy days must be strictly fewer than this share of the trip
+    'require_weekend': True,      # Window must touch a weekend, holiday or PTO day
+    'comfort_low': 70,            # Comfortable daily high, °F
+    'comfort_high': 88,
+    'rain_weight': 1.0,
+    'comfort_weight': 1.0,
+    'weekend_weight': 1.0,
+}
+
+DEFAULT_TOP_K = 10
+
+def compile_ranking_predicates(settings):
+    """Turn ranking thresholds into vectorized predicates over window features.
+    
+    Each predicate takes the feature arrays for one trip length (shape
+    cities x start positions) and returns a boolean array of windows that pass.
+    """
+    max_rain = settings['max_rain_probability']
+    max_rainy_fraction = settings['max_rainy_fraction']
+    
+    predicates = [
+        lambda f: f['complete'],
+        lambda f: f['rainy_days'] < f['days_needed'] * max_rainy_fraction,
+        lambda f: f['start_rain'] <= max_rain,
+        lambda f: f['end_rain'] <= max_rain,
+    ]
+    if settings['require_weekend']:
+        predicates.append(lambda f: f['weekend_adjacent'])
+    return predicates
+
+def build_forecast_matrix(city_forecasts):
+    """Load every city's forecast into arrays on a shared date axis.
+    
+    Returns (dates, arrays) where arrays holds cities x days matrices:
+    'valid' (day present), 'has_rain', 'rain' (probability, missing = 0) and
+    'temp_high' (NaN when missing).
+    """
+    import numpy as np
+    
+    all_dates = [day['date'] for city in city_forecasts for day in city['forecast_data']]
+    first_date = min(all_dates)
+    num_days = (max(all_dates) - first_date).days + 1
+    dates = [first_date + datetime.timedelta(days=offset) for offset in range(num_days)]
+    
+    shape = (len(city_forecasts), num_days)
+    valid = np.zeros(shape, dtype=bool)
+    has_rain = np.zeros(shape, dtype=np.int32)
+    rain = np.zeros(shape, dtype=np.float64)
+    temp_high = np.full(shape, np.nan)
+    
+    for row, city in enumerate(city_forecasts):
+        for day in city['forecast_data']:
+            col = (day['date'] - first_date).days
+            valid[row, col] = True
+            has_rain[row, col] = day['has_rain']
+            rain[row, col] = day['rain_probability'] or 0
+            if day['temp_high'] is not None:
+                temp_high[row, col] = day['temp_high']
+    
+    return dates, {'valid': valid, 'has_rain': has_rain, 'rain': rain, 'temp_high': temp_high}
+
+def window_sums(values, width):
+    """Sum of every `width`-long window along the last axis, via cumulative sums."""
+    import numpy as np
+    
+    values = np.asarray(values, dtype=np.float64)
+    padding = [(0, 0)] * (values.ndim - 1) + [(1, 0)]
+    cumulative = np.pad(np.cumsum(values, axis=-1), padding)
+    return cumulative[..., width:] - cumulative[..., :-width]
+
+def score_windows(city_forecasts, trip_lengths, settings=None, top_k=DEFAULT_TOP_K):
+    """Score every (city, start, length) window in batch and return the best top_k.
+    
+    The score is a weighted mean of three components in [0, 1]: how dry the
+    window is (1 - mean rain probability), the share of days whose high falls
+    in the comfort band, and weekend overlap (days off inside the window, i.e.
+    weekends, holidays and PTO days, capped at two). Windows failing the
+    compiled predicates are dropped. Returns dicts with the city index, start
+    and end dates, nights and scores, best first.
+    """
+    import numpy as np
+    
+    settings = dict(DEFAULT_RANKING_SETTINGS, **(settings or {}))
+    if not city_forecasts:
+        return []
+    
+    dates, arrays = build_forecast_matrix(city_forecasts)
+    num_days = len(dates)
+    predicates = compile_ranking_predicates(settings)
+    
+    # Day-off flags (weekends, holidays, PTO) for the axis plus one day either side, for adjacency
+    calendar = calendar_index(dates[0], dates[-1])
+    first_ordinal = dates[0].toordinal() - 1
+    weekend_extended = np.array([calendar.is_day_off(first_ordinal + offset) for offset in range(num_days + 2)],
+                                dtype=np.float64)
+    
+    temp_high = arrays['temp_high']
+    with np.errstate(invalid='ignore'):
+        comfortable = (temp_high >= settings['comfort_low']) & (temp_high <= settings['comfort_high'])
+    
+    weights = np.array([settings['rain_weight'], settings['comfort_weight'], settings['weekend_weight']])
+    weights = weights / weights.sum()
+    
+    candidates = []
+    for trip_length in sorted({int(length) for length in trip_lengths}):
+        days_needed = trip_length + 1
+        if days_needed > num_days:
+            continue
+        num_starts = num_days - days_needed + 1
+        
+        features = {
+            'days_needed': days_needed,
+            'complete': window_sums(arrays['valid'], days_needed) == days_needed,
+            'rainy_days': window_sums(arrays['has_rain'], days_needed),
+            'start_rain': arrays['rain'][:, :num_starts],
+            'end_rain': arrays['rain'][:, days_needed - 1:],
+            'weekend_adjacent': window_sums(weekend_extended, days_needed + 2) > 0,
+        }
+        
+        passes = np.ones((len(city_forecasts), num_starts), dtype=bool)
+        for predicate in predicates:
+            passes &= predicate(features)
+        
+        rain_score = 1 - window_sums(arrays['rain'], days_needed) / (100 * days_needed)
+        comfort_score = window_sums(comfortable, days_needed) / days_needed
+        weekend_days = window_sums(weekend_extended[1:-1], days_needed)
+        weekend_score = np.broadcast_to(np.minimum(weekend_days, 2) / 2, passes.shape)
+        
+        score = weights[0] * rain_score + weights[1] * comfort_score + weights[2] * weekend_score
+        
+        rows, starts = np.nonzero(passes)
+        candidates.append((
+            score[rows, starts], rows, starts, np.full(len(rows), trip_length),
+            rain_score[rows, starts], comfort_score[rows, starts], weekend_score[rows, starts]
+        ))
+    
+    if not candidates:
+        return []
+    
+    score, rows, starts, lengths, rain_score, comfort_score, weekend_score = (
+        np.concatenate(parts) for parts in zip(*candidates)
+    )
+    
+    # Partial selection first, then a deterministic sort of the survivors:
+    # best score, then earliest start, then input city order, then shortest stay.
+    # Every window tying the K-th score survives, so the tie-break decides among them.
+    if top_k and len(score) > top_k:
+        cutoff = -np.partition(-score, top_k - 1)[top_k - 1]
+        keep = np.flatnonzero(score >= cutoff)
+    else:
+        keep = np.arange(len(score))
+    order = keep[np.lexsort((lengths[keep], rows[keep], starts[keep], -score[keep]))][:top_k or None]
+    
+    ranked = []
+    for index in order:
+        start = int(starts[index])
+        nights = int(lengths[index])
+        ranked.append({
+            'city_index': int(rows[index]),
+            'start_date': dates[start],
+            'end_date': dates[start + nights],
+            'nights': nights,
+            'score': float(score[index]),
+            'rain_score': float(rain_score[index]),
+            'comfort_score': float(comfort_score[index]),
+            'weekend_score': float(weekend_score[index]),
+        })
+    return ranked
+
+def load_city_forecasts(city_names, concurrency=DEFAULT_CONCURRENCY, plan=None):
+    """load_city_forecast for several cities at once, in order; failed cities are None."""
+    plan = plan or plan_requests(city_names)
+    
+    def load(city_name):
+        with city_metrics(city_name):
+            return load_city_forecast(city_name, plan)
+    
+    ordered = plan.order
+    if concurrency <= 1 or len(city_names) <= 1:
+        city_forecasts = [load(city_name) for city_name in ordered]
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(city_names))) as executor:
+            city_forecasts = list(executor.map(load, ordered))
+    forecasts_by_city = dict(zip(ordered, city_forecasts))
+    return [forecasts_by_city[city_name] for city_name in city_names]
+
+def rank_cities(city_names, trip_length, max_price, settings=None, top_k=DEFAULT_TOP_K,
+                concurrency=DEFAULT_CONCURRENCY, plan=None):
+    """Fetch every city's forecast, score all windows together, and return the top_k results."""
+    city_forecasts = [city for city in load_city_forecasts(city_names, concurrency, plan) if city]
+    return rank_city_forecasts(city_forecasts, trip_length, max_price, settings, top_k)
+
+def rank_city_forecasts(city_forecasts, trip_length, max_price, settings=None, top_k=DEFAULT_TOP_K):
+    """Score all windows of already loaded city forecasts together and return the top_k results."""
+    trip_lengths = [trip_length] if isinstance(trip_length, (int, str)) else list(trip_length)
+    results = []
+    for rank, window in enumerate(score_windows(city_forecasts, trip_lengths, settings, top_k), 1):
+        city_forecast = city_forecasts[window['city_index']]
+        forecast_data = as_forecast_table(city_forecast['forecast_data'])
+        start = forecast_data.index_of(window['start_date'])
+        days = forecast_data[start:start + window['nights'] + 1]
+        period = {'start_date': window['start_date'], 'end_date': window['end_date'], 'days': days}
+        
+        result = build_period_result(city_forecast, period, rank, max_price)
+        result.update(score=window['score'], rain_score=window['rain_score'],
+                      comfort_score=window['comfort_score'], weekend_score=window['weekend_score'])
+        results.append(result)
+    return results
+
+def parse_ranking_options(options):
+    """Build ranking settings from --max-rain, --comfort=LOW-HIGH and --weights=rain:2,comfort:1,weekend:1.
+    
+    Raises ValueError for a missing or malformed value, a negative weight or
+    weights that add up to zero.
+    """
+    for name in ('max_rain', 'comfort', 'weights'):
+        if options.get(name) is True:
+            raise ValueError(f"--{name.replace('_', '-')} needs a value")
+    settings = {}
+    if 'max_rain' in options:
+        settings['max_rain_probability'] = float(options['max_rain'])
+    if 'comfort' in options:
+        low, _, high = options['comfort'].partition('-')
+        settings['comfort_low'] = float(low)
+        settings['comfort_high'] = float(high)
+    if 'weights' in options:
+        for part in options['weights'].split(','):
+            name, _, weight = part.partition(':')
+            key = f"{name.strip()}_weight"
+            if key not in DEFAULT_RANKING_SETTINGS:
+                raise ValueError(f"Unknown weight: {name}")
+            settings[key] = float(weight)
+            if settings[key] < 0:
+                raise ValueError(f"Weight can't be negative: {name}")
+        # score_windows normalizes by the total, so it can't be zero
+        weights = dict(DEFAULT_RANKING_SETTINGS, **settings)
+        if not sum(weights[key] for key in ('rain_weight', 'comfort_weight', 'weekend_weight')) > 0:
+            raise ValueError("At least one weight must be above zero")
+    if options.get('any_day'):
+        settings['require_weekend'] = False
+    return settings
+
+def generate_expedia_url(city_name, state_abbr, start_date, end_date, max_price):
+    """Generate an Expedia hotel search URL for the given parameters."""
+    # Format dates as YYYY-MM-DD
+    start_date_str = start_date.strftime("%Y-%m-%d")
+    end_date_str = end_date.strftime("%Y-%m-%d")
+    
+    # Create the destination string
+    if state_abbr:
+        destination = f"{city_name}, {state_abbr}, United States of America"
+    else:
+        destination = f"{city_name}, United States of America"
+    
+    # Build the base URL with parameters
+    base_url = "https://www.expedia.com/Hotel-Search"
+    
+    # Format the URL with explicit price range (min=0, max=specified)
+    query_parts = [
+        f"MDPCID=US.META.HPA.HOTEL-CORESEARCH-desktop.HOTEL",
+        f"adults=2",
+        f"children=",
+        f"destination={quote_plus(destination)}",
+        f"endDate={end_date_str}",
+        f"startDate={start_date_str}",
+        f"sort=REVIEW_RELEVANT",
+        f"paymentType=FREE_CANCELLATION",
+        f"price=0",  # Min price
+        f"price={max_price}",  # Max price
+        f"stay_options_group=hotels_option"  # Ensure only hotels (not vacation homes) are shown
+    ]
+    
+    # Join all parts with &
+    query_string = "&".join(query_parts)
+    
+    return f"{base_url}?{query_string}"
+
+# Hotel search results change quickly, so they are only cached briefly
+EXPEDIA_BASE_URL = 'https://www.expedia.com'
+DEFAULT_HOTEL_TTL_MINUTES = 30
+HOTELS_PER_RESULT = 5
+
+HOTEL_TYPES = {'Hotel', 'LodgingBusiness', 'Resort', 'Motel', 'BedAndBreakfast', 'Hostel', 'Inn'}
+JSON_LD_RE = re.compile(r'<script\b[^>]*\btype=["\']?application/ld\+json["\']?[^>]*>(.*?)</script>', re.S | re.I)
+PRICE_RE = re.compile(r'\$\s?(\d[\d,]*(?:\.\d{2})?)')
+RATING_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:/|out of)\s*(10|5)\b')
+
+_hotel_cache = None
+_hotel_in_flight = {}
+_hotel_lock = threading.Lock()
+_hotel_cache_settings = {'ttl_minutes': DEFAULT_HOTEL_TTL_MINUTES, 'refresh': False}
+
+def hotel_cache_path():
+    """Path of the on-disk hotel results cache."""
+    return os.path.join(CACHE_DIR, 'hotels.json')
+
+def configure_hotel_cache(ttl_minutes=None, refresh=None):
+    """Set the hotel results TTL (in minutes) and whether to bypass cached results."""
+    with _hotel_lock:
+        if ttl_minutes is not None:
+            _hotel_cache_settings['ttl_minutes'] = float(ttl_minutes)
+        if refresh is not None:
+            _hotel_cache_settings['refresh'] = bool(refresh)
+
+def _load_hotel_cache():
+    """Load the hotel cache from disk once per process. Caller holds the lock."""
+    global _hotel_cache
+    if _hotel_cache is None:
+        try:
+            with open(hotel_cache_path()) as f:
+                _hotel_cache = json.load(f)
+        except (OSError, ValueError):
+            _hotel_cache = {}
+    return _hotel_cache
+
+def save_hotel_cache():
+    """Drop expired hotel results and persist the rest."""
+    with _hotel_lock:
+        cache = _load_hotel_cache()
+        ttl_seconds = _hotel_cache_settings['ttl_minutes'] * 60
+        now = time.time()
+        for url in [url for url, entry in cache.items() if now - entry['fetched_at'] > ttl_seconds]:
+            del cache[url]
+        write_json_atomic(hotel_cache_path(), cache)
+
+def hotel_fetch_url(expedia_url):
+    """The URL to fetch for a hotel search link (differs only when replaying)."""
+    return EXPEDIA_BASE_URL + expedia_url[len('https://www.expedia.com'):]
+
+def parse_price(value):
+    """Parse 189, '189.00' or '$1,189' into a float, or None."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = PRICE_RE.search(str(value)) or re.search(r'(\d[\d,]*(?:\.\d+)?)', str(value))
+    return float(match.group(1).replace(',', '')) if match else None
+
+def parse_number(value):
+    """Parse 4.5, '4.5' or '1,234' into a float, or None if it isn't a number."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+def hotel_from_json_ld(item):
+    """Build a hotel record from a schema.org Hotel/LodgingBusiness object.
+    
+    Ratings and review counts come as numbers or strings ('1,234') depending
+    on the site; values that don't parse are left out rather than failing.
+    """
+    rating = None
+    review_count = None
+    aggregate = item.get('aggregateRating')
+    if isinstance(aggregate, dict):
+        rating_value = parse_number(aggregate.get('ratingValue'))
+        best_rating = parse_number(aggregate.get('bestRating')) or 10
+        if rating_value is not None and best_rating > 0:
+            # Normalize to a 10-point scale like the results page shows
+            rating = rating_value * 10 / best_rating
+        count = parse_number(aggregate.get('reviewCount'))
+        if count is None:
+            count = parse_number(aggregate.get('ratingCount'))
+        review_count = int(count) if count else None
+    
+    price = None
+    offers = item.get('offers')
+    if isinstance(offers, list):
+        offers = offers[0] if offers else None
+    if isinstance(offers, dict):
+        price = parse_price(offers.get('price', offers.get('lowPrice', '')))
+    if price is None and item.get('priceRange'):
+        price = parse_price(item['priceRange'])
+    
+    return {
+        'name': item.get('name'),
+        'price': price,
+        'rating': round(rating, 1) if rating is not None else None,
+        'review_count': review_count,
+        'url': item.get('url')
+    }
+
+def parse_hotels_json_ld(html_content):
+    """Hotels from schema.org JSON-LD blocks, including ones nested in ItemLists."""
+    hotels = []
+    for block in JSON_LD_RE.findall(html_content):
+        try:
+            pending = [json.loads(html.unescape(block.strip()))]
+        except ValueError:
+            continue
+        while pending:
+            item = pending.pop(0)
+            if isinstance(item, list):
+                pending.extend(item)
+            elif isinstance(item, dict):
+                item_types = item.get('@type')
+                item_types = item_types if isinstance(item_types, list) else [item_types]
+                if HOTEL_TYPES.intersection(item_types) and item.get('name'):
+                    hotels.append(hotel_from_json_ld(item))
+                else:
+                    pending.extend(value for value in item.values() if isinstance(value, (dict, list)))
+    return hotels
+
+def parse_hotel_cards(html_content):
+    """Hotels from the listing cards on an Expedia results page."""
+    from bs4 import BeautifulSoup
+    
+    soup = BeautifulSoup(html_content, 'html.parser')
+    hotels = []
+    for card in soup.select('[data-stid="lodging-card-responsive"]'):
+        name = card.select_one('h3')
+        if not name:
+            continue
+        text = card.get_text(' ', strip=True)
+        price = PRICE_RE.search(text)
+        rating = RATING_RE.search(text)
+        link = card.select_one('a[href]')
+        hotels.append({
+            'name': name.get_text(strip=True),
+            'price': float(price.group(1).replace(',', '')) if price else None,
+            'rating': round(float(rating.group(1)) * 10 / float(rating.group(2)), 1) if rating else None,
+            'review_count': None,
+            'url': link['href'] if link else None
+        })
+    return hotels
+
+def parse_hotel_results(html_content):
+    """Parse a hotel results page into hotels with name, price, rating (out of 10), review_count and url.
+    
+    Structured JSON-LD data is preferred; the listing cards are the fallback.
+    """
+    return parse_hotels_json_ld(html_content) or parse_hotel_cards(html_content)
+
+def fetch_hotel_results(expedia_url):
+    """Return the parsed hotels for one search URL, or None if the page couldn't be fetched.
+    
+    Identical searches are served from the cache while fresh, and concurrent
+    callers asking for the same search share a single request.
+    """
+    with _hotel_lock:
+        entry = None if _hotel_cache_settings['refresh'] else _load_hotel_cache().get(expedia_url)
+        if entry and time.time() - entry['fetched_at'] <= _hotel_cache_settings['ttl_minutes'] * 60:
+            count_event('hotel_cache_hits')
+            return entry['hotels']
+        in_flight = _hotel_in_flight.get(expedia_url)
+        if in_flight is None:
+            in_flight = _hotel_in_flight[expedia_url] = threading.Event()
+            owner = True
+        else:
+            owner = False
+    
+    if not owner:
+        count_event('hotel_requests_coalesced')
+        in_flight.wait()
+        with _hotel_lock:
+            entry = _load_hotel_cache().get(expedia_url)
+        return entry['hotels'] if entry else None
+    
+    import requests
+    
+    hotels = None
+    try:
+        with stage('hotel_search'):
+            response = http_get(hotel_fetch_url(expedia_url), budgeted=False)
+            if response.status_code == 200:
+                hotels = parse_hotel_results(response.text)
+            else:
+                log.warning("Hotel search returned status %s", response.status_code)
+    except requests.RequestException as e:
+        log.warning("Error fetching hotel results: %s", e)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        # Markup we don't understand costs this search its hotels, not the whole run
+        log.warning("Could not parse hotel results: %s", e)
+    finally:
+        with _hotel_lock:
+            if hotels is not None:
+                _load_hotel_cache()[expedia_url] = {'fetched_at': time.time(), 'hotels': hotels}
+            del _hotel_in_flight[expedia_url]
+        in_flight.set()
+    return hotels
+
+def attach_hotel_results(all_results, concurrency=DEFAULT_CONCURRENCY, save=True):
+    """Fetch hotel results for every result and store them under result['hotels'].
+    
+    Results with the same search URL (the same destination, dates and price,
+    however the city was spelled) share one fetch. Each result keeps the best
+    rated hotels, cheapest first among equals, or None if the fetch failed.
+    With save=False the hotel cache is left for the caller to save_hotel_cache().
+    """
+    urls = list(dict.fromkeys(result['expedia_url'] for result in all_results))
+    count_event('hotel_queries_deduplicated', len(all_results) - len(urls))
+    if not urls:
+        return all_results
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as executor:
+        hotels_by_url = dict(zip(urls, executor.map(fetch_hotel_results, urls)))
+    if save:
+        save_hotel_cache()
+    
+    for result in all_results:
+        hotels = hotels_by_url[result['expedia_url']]
+        if hotels is None:
+            result['hotels'] = None
+            continue
+        ranked = sorted(hotels, key=lambda hotel: (-(hotel['rating'] or 0), hotel['price'] or float('inf')))
+        result['hotel_count'] = len(hotels)
+        result['min_price'] = min((hotel['price'] for hotel in hotels if hotel['price'] is not None), default=None)
+        result['hotels'] = ranked[:HOTELS_PER_RESULT]
+    return all_results
+
+def process_cities(city_names, trip_length, max_price, concurrency=DEFAULT_CONCURRENCY, plan=None):
+    """Process several cities, running up to `concurrency` of them at once.
+    
+    Results are returned in the order the cities were given, regardless of
+    which city finishes first, so downstream sorting stays deterministic.
+    plan is a RequestPlan for these cities; one is made if it isn't given.
+    """
+    plan = plan or plan_requests(city_names)
+    
+    def run(city_name):
+        return process_city(city_name, trip_length, max_price, plan)
+    
+    # Work through the most valuable cities first when there is a request budget
+    ordered = plan.order
+    if concurrency <= 1 or len(city_names) <= 1:
+        per_city_results = [run(city_name) for city_name in ordered]
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(city_names))) as executor:
+            # map() yields results in submission order
+            per_city_results = list(executor.map(run, ordered))
+    
+    results_by_city = dict(zip(ordered, per_city_results))
+    all_results = []
+    for city_name in city_names:
+        all_results.extend(results_by_city[city_name])
+    return all_results
+
+# Results waiting to be consumed when streaming from several worker threads
+STREAM_QUEUE_SIZE = 100
+
+def iter_results(city_names, trip_length, max_price, concurrency=DEFAULT_CONCURRENCY, prepare=None, plan=None):
+    """Yield every city's results as they are found, in whatever order cities finish.
+    
+    With concurrency 1 the cities run one after another on the calling thread.
+    Otherwise workers hand results over through a bounded queue, so a slow city
+    only holds back its own results and memory stays flat however long the scan.
+    With prepare, each city's results are passed to prepare(results) as one
+    list (on the thread that found them) before any of them are yielded.
+    plan is a RequestPlan for these cities; one is made if it isn't given.
+    """
+    plan = plan or plan_requests(city_names)
+    
+    def city_periods(city_name):
+        periods = iter_city_periods(city_name, trip_length, max_price, plan)
+        return prepare(list(periods)) if prepare else periods
+    
+    city_names = plan.order
+    if concurrency <= 1 or len(city_names) <= 1:
+        for city_name in city_names:
+            with city_metrics(city_name):
+                yield from city_periods(city_name)
+        return
+    
+    results = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+    city_done = object()
+    
+    def run(city_name):
+        try:
+            if stop.is_set():
+                return
+            with city_metrics(city_name):
+                for result in city_periods(city_name):
+                    if stop.is_set():
+                        break
+                    results.put(result)
+        finally:
+            results.put(city_done)
+    
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(city_names))) as executor:
+        futures = [executor.submit(run, city_name) for city_name in city_names]
+        remaining = len(futures)
+        try:
+            while remaining:
+                item = results.get()
+                if item is city_done:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            # If the consumer stopped early, drop cities that haven't started
+            # and let blocked workers finish
+            stop.set()
+            for future in futures:
+                if future.cancel():
+                    remaining -= 1
+            while remaining:
+                if results.get() is city_done:
+                    remaining -= 1
+        for future in futures:
+            if not future.cancelled():
+                future.result()
+
+class TopResults:
+    """Bounded buffer of the best results seen so far: least rain first, then earliest start."""
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.count = 0
+    
+    def push(self, result):
+        # heapq keeps the smallest entry at the root, so invert the keys to evict the worst result
+        entry = (-result['rain_percentage'], -result['start_date'].toordinal(), -self.count, result)
+        self.count += 1
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, entry)
+        else:
+            heapq.heappushpop(self.heap, entry)
+    
+    def results(self):
+        return [entry[-1] for entry in sorted(self.heap, reverse=True)]
+
+def stream_cities(city_names, trip_length, max_price, concurrency=DEFAULT_CONCURRENCY, top_k=None, emit=None,
+                  prepare=None, plan=None):
+    """Scan cities as a stream, passing each result to emit(result) as soon as it is found.
+    
+    Returns the best top_k results when top_k is set. Otherwise returns every
+    result, or nothing when emit is given, so output-only runs keep no results.
+    prepare and plan are passed on to iter_results.
+    """
+    top = TopResults(top_k) if top_k else None
+    kept = []
+    for result in iter_results(city_names, trip_length, max_price, concurrency, prepare, plan):
+        if emit:
+            emit(result)
+        if top:
+            top.push(result)
+        elif not emit:
+            kept.append(result)
+    return top.results() if top else kept
+
+def write_jsonl_record(record_type, result, rank=None):
+    """Write one result to stdout as a JSON line and flush so readers see it immediately."""
+    record = {'type': record_type}
+    if rank is not None:
+        record['rank'] = rank
+    record.update(result_to_json(result))
+    sys.stdout.write(json.dumps(record) + '\n')
+    sys.stdout.flush()
+
+# Minutes between checks in --watch mode
+DEFAULT_WATCH_INTERVAL_MINUTES = 30
+
+def period_key(result):
+    return (result['start_date'], result['end_date'], result['city'])
+
+def check_city(city_name, trip_length, max_price, previous, plan=None):
+    """Refresh one city for watch mode.
+    
+    `previous` is the city's (forecast_hash, results) from the last check, or
+    None. Returns the new pair, reusing the old results when the forecast
+    table is unchanged, or `previous` if the forecast could not be loaded.
+    """
+    with city_metrics(city_name):
+        city_forecast = load_city_forecast(city_name, plan)
+        if not city_forecast:
+            return previous
+        forecast_hash = city_forecast['forecast_hash']
+        if previous is not None and forecast_hash is not None and forecast_hash == previous[0]:
+            count_event('watch_cities_unchanged')
+            return previous
+        count_event('watch_cities_reevaluated')
+        return forecast_hash, list(iter_forecast_periods(city_forecast, trip_length, max_price))
+
+def watch(city_names, trip_length, max_price, interval_minutes=DEFAULT_WATCH_INTERVAL_MINUTES,
+          concurrency=DEFAULT_CONCURRENCY, on_change=None, rounds=None):
+    """Re-check every city each interval and report periods that appear or disappear.
+    
+    Every check revalidates the forecasts, which costs one conditional request
+    per city; cities whose forecast table is unchanged are not re-parsed or
+    re-evaluated. on_change(added, removed) is called with lists of results
+    whenever the set of suitable periods changes, including the first check.
+    Runs until interrupted, or for `rounds` checks, then puts the forecast
+    cache's refresh setting back and returns the last check's RequestPlan.
+    """
+    with _forecast_cache_lock:
+        previous_refresh = _forecast_cache_settings['refresh']
+    configure_forecast_cache(refresh=True)
+    state = {}
+    known = {}
+    check = 0
+    plan = None
+    try:
+        while rounds is None or check < rounds:
+            check += 1
+            round_start = time.perf_counter()
+            
+            # Under a per-hour budget, cities that don't fit this round wait for a later one
+            plan = plan_requests(city_names)
+            
+            def refresh(city_name):
+                return city_name, check_city(city_name, trip_length, max_price, state.get(city_name), plan)
+            
+            ordered = plan.order
+            if concurrency <= 1 or len(city_names) <= 1:
+                checked = [refresh(city_name) for city_name in ordered]
+            else:
+                with ThreadPoolExecutor(max_workers=min(concurrency, len(city_names))) as executor:
+                    checked = list(executor.map(refresh, ordered))
+            
+            current = {}
+            for city_name, city_state in checked:
+                if city_state is not None:
+                    state[city_name] = city_state
+                    current.update((period_key(result), result) for result in city_state[1])
+            
+            added = sorted((current[key] for key in current.keys() - known.keys()), key=period_key)
+            removed = sorted((known[key] for key in known.keys() - current.keys()), key=period_key)
+            known = current
+            if history_enabled():
+                flush_forecast_history()
+            save_schedule_state()
+            save_location_cache()
+            log.info("Check %d: %d periods, %d added, %d removed (%.1fs)",
+                     check, len(current), len(added), len(removed), time.perf_counter() - round_start)
+            if (added or removed) and on_change is not None:
+                on_change(added, removed)
+            
+            if rounds is None or check < rounds:
+                time.sleep(interval_minutes * 60)
+    finally:
+        configure_forecast_cache(refresh=previous_refresh)
+    return plan
+
+def print_budget_report(budget, stream=None):
+    """List the cities served a stale forecast or skipped, with the request budget if there is one."""
+    stream = stream or sys.stdout
+    if budget['limited']:
+        remaining = f", {budget['remaining']} left" if budget['remaining'] is not None else ""
+        print(f"\nRequest budget: {budget['spent']} requests made{remaining}", file=stream)
+    if budget['served_stale']:
+        print(f"Served last-known forecasts for {len(budget['served_stale'])} cities:", file=stream)
+        for city_name, age_minutes in sorted(budget['served_stale'].items()):
+            print(f"  {city_name} ({format_age(age_minutes)} old)", file=stream)
+    if budget['skipped']:
+        print(f"Skipped {len(budget['skipped'])} cities with no cached forecast: {', '.join(budget['skipped'])}", file=stream)
+
+def format_age(minutes):
+    """'45 min', '6 h' or '3 days'."""
+    if minutes < 120:
+        return f"{minutes:.0f} min"
+    if minutes < 48 * 60:
+        return f"{minutes / 60:.0f} h"
+    return f"{minutes / 1440:.0f} days"
+
+def print_period_changes(added, removed):
+    """Print watch mode changes, one line per period."""
+    print(f"\n[{datetime.datetime.now():%Y-%m-%d %H:%M}] Suitable periods changed:")
+    for sign, results in (('+', added), ('-', removed)):
+        for result in results:
+            print(f"{sign} {result['city']}: {result['start_date_str']} to {result['end_date_str']} "
+                  f"({result['nights']} nights, rain {result['rain_percentage']:.0f}%)")
+            if sign == '+':
+                print(f"  {result['expedia_url']}")
+    sys.stdout.flush()
+
+# Default port for --serve
+DEFAULT_API_PORT = 8765
+
+def result_to_json(result):
+    """JSON-ready copy of a result: what print_summary shows plus the hotel search URL."""
+    record = {
+        'city': result['city'],
+        'start_date': result['start_date'].isoformat(),
+        'end_date': result['end_date'].isoformat(),
+        'nights': result['nights'],
+        'rainy_days': result['rainy_days'],
+        'rain_percentage': round(result['rain_percentage'], 1),
+        'days': [{
+            'date': day['date'].isoformat(),
+            'description': day['description'],
+            'temp_high': day['temp_high'],
+            'temp_low': day['temp_low'],
+            'rain_probability': day['rain_probability']
+        } for day in result['days_data']],
+        'expedia_url': result['expedia_url'],
+        'days_off_needed': result.get('days_off_needed'),
+        'holidays': result.get('holidays', [])
+    }
+    if 'rain_trend' in result:
+        record['rain_trend'] = result['rain_trend']
+    if 'hotels' in result:
+        record['hotels'] = result['hotels']
+        record['hotel_count'] = result.get('hotel_count')
+        record['min_price'] = result.get('min_price')
+    for name in ('score', 'rain_score', 'comfort_score', 'weekend_score'):
+        if name in result:
+            record[name] = round(float(result[name]), 4)
+    return record
+
+def is_true(value):
+    """Interpret a flag from JSON or a query string ('1', 'true', 'yes', True)."""
+    return value is True or str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def days_off_order(result):
+    """Sort key putting stays that need the fewest working days off first, then by date."""
+    return (result['days_off_needed'], result['start_date'])
+
+def parse_query(params):
+    """Validate search parameters as accepted by the API and batch files.
+    
+    params holds cities (a list or an '&'-separated string), trip_length
+    ('2', '1-3', '1,2,4' or a list), max_price and optionally hotels,
+    fewest_days_off and the ranking options rank, top, max_rain, comfort,
+    weights and any_day. Returns a dict of parsed values. Raises ValueError
+    for missing or invalid parameters.
+    """
+    cities = params.get('cities') or []
+    if isinstance(cities, str):
+        cities = cities.split('&')
+    if not isinstance(cities, list):
+        raise ValueError("cities must be a list or an '&'-separated string")
+    city_names = [str(city).strip() for city in cities if str(city).strip()]
+    if not city_names:
+        raise ValueError("No cities specified")
+    
+    trip_length = params.get('trip_length')
+    if trip_length is None:
+        raise ValueError("trip_length is required")
+    if isinstance(trip_length, list):
+        trip_length = ','.join(str(length) for length in trip_length)
+    if isinstance(trip_length, bool) or not isinstance(trip_length, (str, int)):
+        raise ValueError("trip_length must be a number, a range like '1-3' or a list")
+    trip_lengths = parse_trip_lengths(trip_length)
+    
+    try:
+        max_price = int(params['max_price'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("max_price must be a positive integer")
+    if max_price < 1:
+        raise ValueError("max_price must be a positive integer")
+    
+    query = {
+        'city_names': city_names,
+        'trip_lengths': trip_lengths,
+        'trip_length': trip_lengths[0] if len(trip_lengths) == 1 else trip_lengths,
+        'max_price': max_price,
+        'ranked': is_true(params.get('rank', False)),
+        'hotels': is_true(params.get('hotels', False)),
+        'fewest_days_off': is_true(params.get('fewest_days_off', False))
+    }
+    if query['ranked']:
+        ranking_options = {name: str(params[name]) for name in ('max_rain', 'comfort', 'weights') if name in params}
+        if is_true(params.get('any_day', False)):
+            ranking_options['any_day'] = True
+        query['ranking_settings'] = parse_ranking_options(ranking_options)
+        try:
+            query['top_k'] = int(params.get('top', DEFAULT_TOP_K))
+        except (TypeError, ValueError):
+            raise ValueError("top must be a positive integer")
+        if query['top_k'] < 1:
+            raise ValueError("top must be a positive integer")
+    return query
+
+def query_summary(query, all_results, elapsed_ms, plan=None):
+    """JSON-ready summary of one query's results; plan is the RequestPlan they were fetched under."""
+    budget = budget_report(plan)
+    return {
+        'title': "TOP RANKED RESULTS" if query['ranked'] else "SUMMARY OF ALL RESULTS",
+        'cities': query['city_names'],
+        'trip_lengths': query['trip_lengths'],
+        'max_price': query['max_price'],
+        'results': [result_to_json(result) for result in all_results],
+        'served_stale': [city for city in query['city_names'] if city in budget['served_stale']],
+        'skipped': [city for city in query['city_names'] if city in budget['skipped']],
+        'elapsed_ms': elapsed_ms
+    }
+
+def run_query(params, concurrency=DEFAULT_CONCURRENCY):
+    """Run one search from API parameters (see parse_query) and return a JSON-ready summary.
+    
+    Raises ValueError for missing or invalid parameters.
+    """
+    query = parse_query(params)
+    city_names = query['city_names']
+    trip_length = query['trip_length']
+    max_price = query['max_price']
+    
+    start = time.perf_counter()
+    plan = plan_requests(city_names)
+    if query['ranked']:
+        all_results = rank_cities(city_names, trip_length, max_price, query['ranking_settings'],
+                                  query['top_k'], concurrency, plan)
+    else:
+        all_results = process_cities(city_names, trip_length, max_price, concurrency, plan)
+        all_results.sort(key=days_off_order if query['fewest_days_off'] else lambda x: x['start_date'])
+    if query['hotels']:
+        attach_hotel_results(all_results, concurrency)
+    if history_enabled():
+        attach_forecast_trends(all_results)
+    
+    return query_summary(query, all_results, round((time.perf_counter() - start) * 1000, 1), plan)
+
+def evaluate_query(query, forecasts_by_city, period_cache):
+    """Results for one parsed query from forecasts that are already loaded.
     
-    if not location_result:
-        print(f"Could not find location for {city_name}")
-        return []
-        
-    location_id, city, full_location = location_result
+    period_cache maps (location_id, trip lengths) to find_suitable_periods
+    output, so queries that share a city and trip length search it only once;
+    only the Expedia URLs depend on the price.
+    """
+    city_forecasts = [forecasts_by_city[city_name] for city_name in query['city_names']
+                      if forecasts_by_city.get(city_name)]
+    if query['ranked']:
+        return rank_city_forecasts(city_forecasts, query['trip_length'], query['max_price'],
+                                   query['ranking_settings'], query['top_k'])
     
-    # Extract state from full location text (format is typically "USA, State, City")
-    state_match = re.search(r'USA,\s*([\w\s\-]+),', full_location)
-    state = state_match.group(1).strip() if state_match else None
+    all_results = []
+    for city_forecast in city_forecasts:
+        key = (city_forecast['location_id'], tuple(query['trip_lengths']))
+        periods = period_cache.get(key)
+        if periods is None:
+            with stage('window_search'):
+                periods = period_cache[key] = find_suitable_periods(city_forecast['forecast_data'],
+                                                                    query['trip_lengths'])
+        all_results.extend(build_period_result(city_forecast, period, i, query['max_price'])
+                           for i, period in enumerate(periods, 1))
+    all_results.sort(key=days_off_order if query['fewest_days_off'] else lambda x: x['start_date'])
+    return all_results
+
+def answer_batch(queries, concurrency=DEFAULT_CONCURRENCY):
+    """Answer many searches from one set of forecasts.
     
-    # Get state abbreviation if we have a state
-    state_abbr = None
-    if state:
-        state_name_to_abbr = {v: k for k, v in {
-            'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
-            'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
-            'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
-            'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
-            'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri',
-            'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey',
-            'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
-            'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
-            'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
-            'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
-            'DC': 'District of Columbia'
-        }.items()}
-        
-        # Find closest matching state
-        for state_name in state_name_to_abbr:
-            if state_name.lower() in state.lower() or state.lower() in state_name.lower():
-                state_abbr = state_name_to_abbr[state_name]
-                break
+    Every distinct city across all queries is resolved, downloaded and parsed
+    once, then each query is evaluated against those forecasts in memory, so
+    the cost grows with the number of unique cities rather than queries.
+    Returns (answers, load_ms, plan): answers holds a (query, results,
+    elapsed_ms) triple per query, in order, where an invalid query has its
+    ValueError in place of the parsed query and None for results, and plan is
+    the RequestPlan the forecasts were fetched under.
+    """
+    start = time.perf_counter()
+    parsed = []
+    for params in queries:
+        try:
+            if not isinstance(params, dict):
+                raise ValueError("Each query must be a JSON object")
+            parsed.append(parse_query(params))
+        except ValueError as e:
+            parsed.append(e)
     
-    print(f"Fetching 14-day forecast for location ID {location_id}...")
-    html_content = get_weather_forecast(location_id)
+    city_names = list(dict.fromkeys(city_name for query in parsed if isinstance(query, dict)
+                                    for city_name in query['city_names']))
+    log.info("Batch of %d queries covers %d distinct cities", len(queries), len(city_names))
+    plan = plan_requests(city_names)
+    forecasts_by_city = dict(zip(city_names, load_city_forecasts(city_names, concurrency, plan)))
+    load_ms = round((time.perf_counter() - start) * 1000, 1)
     
-    if not html_content:
-        print(f"Could not fetch forecast for {city_name}")
-        return []
+    period_cache = {}
+    answered = []
+    for query in parsed:
+        if isinstance(query, ValueError):
+            answered.append((query, None, None))
+            continue
+        query_start = time.perf_counter()
+        results = evaluate_query(query, forecasts_by_city, period_cache)
+        answered.append((query, results, round((time.perf_counter() - query_start) * 1000, 1)))
     
-    print("Parsing forecast data...")
-    forecast_data = parse_forecast(html_content)
+    # Hotel searches repeat across queries too, so fetch them for the whole batch at once
+    hotel_results = [result for query, results, _ in answered if results and query['hotels'] for result in results]
+    if hotel_results:
+        attach_hotel_results(hotel_results, concurrency)
+    if history_enabled():
+        attach_forecast_trends([result for _, results, _ in answered if results for result in results])
+    return answered, load_ms, plan
+
+def run_batch(queries, concurrency=DEFAULT_CONCURRENCY):
+    """Run answer_batch and return one JSON-ready summary per query.
     
-    if not forecast_data:
-        print(f"No forecast data found for {city_name}")
-        return []
+    An invalid query gets an {'error': ...} entry instead.
+    """
+    answered, load_ms, plan = answer_batch(queries, concurrency)
+    summaries = []
+    for query, results, elapsed_ms in answered:
+        if results is None:
+            summaries.append({'error': str(query)})
+        else:
+            summaries.append(dict(query_summary(query, results, elapsed_ms, plan), load_ms=load_ms))
+    return summaries
+
+def read_batch_queries(path):
+    """Read queries from a JSON array or JSON Lines file of search parameter objects."""
+    with open(path) as f:
+        content = f.read()
+    stripped = content.strip()
+    if stripped.startswith('['):
+        return json.loads(stripped)
+    return [json.loads(line) for line in content.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+def serve(port=DEFAULT_API_PORT, concurrency=DEFAULT_CONCURRENCY, host='127.0.0.1'):
+    """Answer searches over the local JSON API until interrupted.
     
-    print(f"Found forecast data for {len(forecast_data)} days")
+    The process stays up, so the HTTP session, location lookups and parsed
+    forecasts stay warm from one request to the next.
+    """
+    import api_server
     
-    print(f"Finding {trip_length}-night periods with good weather that are weekend-adjacent...")
-    suitable_periods = find_suitable_periods(forecast_data, trip_length)
+    server, base_url = api_server.start_server(
+        lambda params: run_query(params, concurrency), transport_stats, port, host,
+        lambda queries: run_batch(queries, concurrency)
+    )
+    print(f"Serving trip searches at {base_url}/search (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def start_recording(store_dir):
+    """Record every search, forecast and hotel results response of this run into a fixture store."""
+    import replay_server
     
-    if not suitable_periods:
-        print(f"No suitable periods found in the 14-day forecast for {city_name}")
-        return []
+    set_recorder(replay_server.FixtureStore(store_dir))
+    # Bypass the caches so everything goes over the wire, and read complete bodies
+    configure_location_cache(refresh=True)
+    configure_forecast_cache(refresh=True, stream=False)
+    configure_hotel_cache(refresh=True)
+    log.info("Recording responses to %s", store_dir)
+
+def start_replay(store_dir, latency=None, error_rate=0):
+    """Serve a fixture store from a local stand-in and send timeanddate.com and Expedia requests to it.
     
-    # Prepare results for this city
-    city_results = []
+    Caches are bypassed and moved to a separate directory so replayed data
+    never mixes with real data. Returns the running server.
+    """
+    global CACHE_DIR, TIMEANDDATE_BASE_URL, EXPEDIA_BASE_URL
+    import replay_server
     
-    print(f"\nSuitable periods for {city_name}:")
-    for i, period in enumerate(suitable_periods, 1):
-        start_date = period['start_date']
-        end_date = period['end_date']
-        
-        start_date_str = start_date.strftime("%a, %b %d")
-        end_date_str = end_date.strftime("%a, %b %d")
-        
-        # Calculate the number of days in the range
-        days_in_range = (end_date - start_date).days + 1
-        
-        # Calculate nights from days
-        nights = days_in_range - 1
-        
-        # Count rainy days
-        rainy_days = sum(1 for day in period['days'] if day['has_rain'])
-        total_days = len(period['days'])
-        rain_percentage = (rainy_days / total_days) * 100
-        
-        print(f"{i}. {start_date_str} to {end_date_str} ({nights} nights / {days_in_range} days)")
-        print(f"   Rain: {rainy_days}/{total_days} days ({rain_percentage:.1f}%)")
-        
-        # Collect forecast details
-        forecast_details = []
-        for day in period['days']:
-            date_str = day['date'].strftime("%a, %b %d")
-            temp_str = ""
-            if day['temp_high'] and day['temp_low']:
-                temp_str = f" [{day['temp_high']}°F / {day['temp_low']}°F]"
-            
-            # Add rain probability if available
-            rain_prob_str = ""
-            if day['rain_probability'] is not None:
-                rain_prob_str = f" (Rain: {day['rain_probability']}%)"
-                
-            forecast_details.append(f"   - {date_str}{temp_str}: {day['description']}{rain_prob_str}")
-            print(forecast_details[-1])
-        
-        # Generate Expedia URL for this period
-        expedia_url = generate_expedia_url(city, state_abbr, start_date, end_date, max_price)
-        print(f"   Hotel search: {expedia_url}")
-        
-        # Add this period to the city's results
-        city_results.append({
-            'city': city_name,
-            'period_num': i,
-            'start_date': start_date,
-            'end_date': end_date,
-            'start_date_str': start_date_str,
-            'end_date_str': end_date_str,
-            'nights': nights,
-            'days': days_in_range,
-            'forecast': forecast_details,
-            'expedia_url': expedia_url,
-            'rain_percentage': rain_percentage,
-            'days_data': period['days']  # Include full days data for summary
+    server, TIMEANDDATE_BASE_URL = replay_server.start_server(store_dir, latency, error_rate)
+    EXPEDIA_BASE_URL = TIMEANDDATE_BASE_URL
+    CACHE_DIR = os.path.join(CACHE_DIR, 'replay')
+    configure_location_cache(refresh=True)
+    configure_forecast_cache(refresh=True)
+    configure_hotel_cache(refresh=True)
+    log.info("Replaying %d recorded responses from %s at %s", len(server.store.index), store_dir, TIMEANDDATE_BASE_URL)
+    return server
+
+class CityLogFilter(logging.Filter):
+    """Attach the city being processed on the current thread to each log record."""
+    def filter(self, record):
+        record.city = current_city()
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per log record, for machine-readable progress output."""
+    def format(self, record):
+        return json.dumps({
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'city': getattr(record, 'city', None),
+            'message': record.getMessage().strip()
         })
-        
-    return city_results
 
-def get_weather_forecast(location_id):
-    """Get the 14-day weather forecast for a given location ID."""
-    forecast_url = f"https://www.timeanddate.com/weather/@{location_id}/ext"
+def setup_logging(quiet=False, log_format='text', stream=None):
+    """Send progress logging to stdout (or stream), as plain text (like the old prints) or JSON lines."""
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.addFilter(CityLogFilter())
+    if log_format == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(message)s'))
+    log.handlers[:] = [handler]
+    log.setLevel(logging.WARNING if quiet else logging.INFO)
+    log.propagate = False
+
+def write_profile_report(path, run_record):
+    """Write per-city metrics records followed by the run record as JSON lines."""
+    with open(path, 'w') as f:
+        for record in collected_metrics():
+            f.write(json.dumps(record, default=str) + '\n')
+        f.write(json.dumps(run_record, default=str) + '\n')
+
+def run_with_cprofile(path, function, *args):
+    """Run function under cProfile, save the stats to path and print the hottest calls."""
+    import cProfile
+    import pstats
     
+    profiler = cProfile.Profile()
+    profiler.enable()
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(forecast_url, headers=headers)
-        response.raise_for_status()
-        return response.text
-    except Exception as e:
-        print(f"Error fetching weather forecast: {e}")
-        return None
+        return function(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"\ncProfile stats saved to {path}; top functions by cumulative time:")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(15)
 
-def parse_forecast(html_content):
-    """Parse the HTML content to extract weather forecast data."""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    forecast_data = []
+def parse_options(argv):
+    """Split `--name=value` and `--flag` options from positional arguments.
     
-    # Find the forecast table - using the id from the sample file
-    forecast_table = soup.find('table', id='wt-ext')
+    Returns (options, positional) where option names have their leading dashes
+    stripped and remaining dashes turned into underscores. Bare flags map to True.
+    """
+    options = {}
+    positional = []
+    for arg in argv:
+        if arg.startswith('--') and len(arg) > 2:
+            name, sep, value = arg[2:].partition('=')
+            options[name.replace('-', '_')] = value if sep else True
+        else:
+            positional.append(arg)
+    return options, positional
+
+def option_value(options, name, default=None):
+    """The value given for an option, or default if it wasn't given.
     
-    if not forecast_table:
-        print("Could not find forecast table with id 'wt-ext'")
-        # Try alternative selectors
-        forecast_table = soup.select_one('table.zebra, table.fw, table.tb-wt')
-        if not forecast_table:
-            print("Could not find any forecast tables")
-            return []
+    Raises ValueError for a bare --flag, which parse_options maps to True,
+    on an option that needs a value.
+    """
+    value = options.get(name, default)
+    if value is True:
+        raise ValueError(f"--{name.replace('_', '-')} needs a value")
+    return value
+
+def print_usage():
+    print("Usage: python weather_trip_planner.py [options] <trip_length_in_nights> <max_price> <city_name1> [& <city_name2> ...]")
+    print("Example: python weather_trip_planner.py 2 400 'Ocean City, MD & Virginia Beach, VA'")
+    print("Trip length may also be a range (1-3) or list (1,2,4) to search several lengths in one run.")
+    print("\nOptions:")
+    print(f"  --concurrency=N           Number of cities to process at once (default: {DEFAULT_CONCURRENCY})")
+    print(f"  --per-host=N              Max simultaneous requests to one host (default: {DEFAULT_PER_HOST_LIMIT})")
+    print("  --stats                   Print HTTP request, retry and connection reuse counters")
+    print(f"  --location-ttl=DAYS       How long a cached city -> location ID lookup is valid (default: {DEFAULT_LOCATION_TTL_DAYS})")
+    print("  --refresh-locations       Ignore cached location IDs and search again")
+    print("  --clear-location-cache    Remove every cached location ID")
+    print("  --prewarm-locations=FILE  Resolve and cache every city listed in FILE, then exit")
+    print("  --gazetteer=PATH          Bundled gazetteer of places and location IDs (default: gazetteer.json)")
+    print("  --no-gazetteer            Skip the gazetteer and resolve every uncached city by searching")
+    print(f"  --forecast-ttl=MINUTES    How long a cached forecast is used without revalidating (default: {DEFAULT_FORECAST_TTL_MINUTES})")
+    print(f"  --forecast-cache-size=N   Max forecasts kept in the cache (default: {DEFAULT_FORECAST_CACHE_SIZE})")
+    print("  --refresh-forecasts       Revalidate every forecast with the server, ignoring the TTL")
+    print("  --mirror=URL              Backup forecast source: a timeanddate.com mirror's base URL, or a JSON")
+    print("                            service URL containing {location_id}; slow requests are hedged to it")
+    print(f"  --hedge-percentile=P      Ask the mirror once the primary is slower than its Pth percentile (default: {DEFAULT_HEDGE_PERCENTILE})")
+    print("  --stream                  Stop downloading forecast pages once the forecast table has arrived")
+    print("  --budget=N                Make at most N timeanddate.com requests this run")
+    print("  --budget-per-hour=N       Make at most N timeanddate.com requests in any hour, across runs")
+    print("  --priority='CITY=W & ...' Weight cities when the budget is short (default weight: 1)")
+    print(f"  --watch[=MINUTES]         Re-check the cities every MINUTES (default: {DEFAULT_WATCH_INTERVAL_MINUTES}) and report periods that appear or disappear")
+    print("  --watch-rounds=N          Stop watching after N checks")
+    print("  --history[=PATH]          Keep every fetched forecast in a SQLite history and show each period's rain trend")
+    print(f"  --history-fetches=N       Number of past forecasts a rain trend covers (default: {DEFAULT_HISTORY_FETCHES})")
+    print("  --parse-workers[=N]       Parse pages in N worker processes (default without N: one per CPU);")
+    print("                            off by default, only helps with large pages and idle cores")
+    print(f"  --parse-batch=N           Pages sent to a parse worker at once (default: {DEFAULT_PARSE_BATCH_SIZE})")
+    print("  --profile[=PATH]          Write per-city stage timings and counters as JSON lines (default: profile.jsonl)")
+    print("  --cprofile[=PATH]         Capture a cProfile of the run (default: weather_trip_planner.prof)")
+    print("  --quiet                   Only log warnings and errors while processing")
+    print("  --log-format=json         Log progress as JSON lines tagged with the city")
+    print("  --record=DIR              Save every search and forecast response into a fixture store")
+    print("  --replay=DIR              Serve a fixture store from a local stand-in server instead of timeanddate.com")
+    print("  --replay-latency=MS       Stand-in delay per request, fixed (50) or a range (20-200)")
+    print("  --replay-error-rate=R     Fraction of stand-in requests that fail with 503 (e.g. 0.05)")
+    print(f"  --serve[=PORT]            Run a local JSON API for searches, keeping caches warm (default port: {DEFAULT_API_PORT})")
+    print("  --batch=FILE              Answer every query in FILE (JSON array or lines) from one download of each city")
+    print("  --host=ADDRESS            Address for --serve to listen on (default: 127.0.0.1)")
+    print("  --hotels                  Fetch Expedia hotel results (count, prices, ratings) for every period")
+    print(f"  --hotel-ttl=MINUTES       How long fetched hotel results are reused (default: {DEFAULT_HOTEL_TTL_MINUTES})")
+    print("  --rank                    Score every window across all cities and show the best ones (needs numpy)")
+    print(f"  --top=K                   Number of results to show: ranked (default: {DEFAULT_TOP_K}), or the K with least rain")
+    print("  --output=jsonl            Write each period as a JSON line as soon as it is found, with no prompt")
+    print("  --max-rain=PCT            Ranking: max rain chance on arrival/departure day (default: 30)")
+    print("  --comfort=LOW-HIGH        Ranking: comfortable daily high in °F (default: 70-88)")
+    print("  --weights=rain:W,comfort:W,weekend:W   Ranking: relative weight of each score component")
+    print("  --any-day                 Ranking: don't require the trip to touch a weekend or day off")
+    print("  --pto=DATES               Extra days off, e.g. 2026-05-26,2026-07-01..2026-07-03 (count like weekends)")
+    print("  --no-holidays             Don't treat federal holidays as days off")
+    print("  --fewest-days-off         Sort the summary by working days each stay needs off, then by date")
+
+def main():
+    options, args = parse_options(sys.argv[1:])
+    # JSON Lines output owns stdout, so progress and reports go to stderr
+    jsonl = options.get('output') == 'jsonl'
+    report = sys.stderr if jsonl else sys.stdout
+    setup_logging(quiet=bool(options.get('quiet')), log_format=options.get('log_format', 'text'), stream=report)
     
-    # Find all rows in the tbody section of the table
-    tbody = forecast_table.find('tbody')
-    if not tbody:
-        print("No tbody found in forecast table")
-        rows = forecast_table.find_all('tr')
-    else:
-        rows = tbody.find_all('tr')
+    if options.get('output', 'text') not in ('text', 'jsonl'):
+        print("Output must be text or jsonl")
+        return
     
-    if not rows:
-        print("No rows found in forecast table")
-        return []
+    if options.get('help') or (len(args) < 3 and not any(
+            name in options for name in ('clear_location_cache', 'prewarm_locations', 'serve', 'batch'))):
+        print_usage()
+        return
     
-    print(f"Found {len(rows)} rows in forecast table")
+    try:
+        concurrency = int(option_value(options, 'concurrency', DEFAULT_CONCURRENCY))
+        per_host_limit = int(option_value(options, 'per_host', DEFAULT_PER_HOST_LIMIT))
+        if concurrency < 1 or per_host_limit < 1:
+            print("Concurrency and per-host limits must be positive integers")
+            return
+    except ValueError:
+        print("Concurrency and per-host limits must be numbers")
+        return
     
-    for row in rows:
-        try:
-            # Skip rows that don't have a th element (header cells with dates)
-            th = row.find('th')
-            if not th:
-                continue
-            
-            # Extract the day of week and date from the th
-            day_span = th.find('span', class_='smaller')
-            if not day_span:
-                continue
-                
-            day_of_week = day_span.text.strip()
-            
-            # The month and day are in the text after the span
-            # This captures text like "May 10" that follows the span and br tag
-            date_text = th.decode_contents()
-            month_day_match = re.search(r'<br/?>([\w]+)\s+(\d{1,2})', date_text)
-            
-            if not month_day_match:
-                print(f"Could not extract month/day from: {date_text}")
-                continue
-                
-            month_abbr = month_day_match.group(1)
-            day = int(month_day_match.group(2))
-            
-            # Find the weather description from img title attribute
-            weather_img = row.find('img', class_='mtt')
-            weather_desc = ""
-            if weather_img and weather_img.has_attr('title'):
-                weather_desc = weather_img['title']
-            
-            # Extract temperature
-            temp_cell = None
-            for cell in row.find_all('td'):
-                if '°F' in cell.text or '°C' in cell.text:
-                    temp_cell = cell
-                    break
-            
-            temp_high = None
-            temp_low = None
-            if temp_cell:
-                temp_text = temp_cell.text.strip()
-                temp_match = re.search(r'(\d+)\s*/\s*(\d+)', temp_text)
-                if temp_match:
-                    temp_high = int(temp_match.group(1))
-                    temp_low = int(temp_match.group(2))
-            
-            # Check for precipitation in the row
-            precip_cells = row.find_all('td')
-            has_rain = False
-            rain_probability = None
-            
-            if weather_desc:
-                # Check weather description for rain-related terms
-                has_rain = any(term in weather_desc.lower() for term in 
-                              ['rain', 'shower', 'drizzle', 'thunderstorm', 
-                               'precipitation', 'sprinkle', 'tstorm'])
-            
-            # If no weather description found, check for precipitation chance
-            if len(precip_cells) >= 8:  # The chance column is usually 8th td
-                chance_cell = precip_cells[7]  # 0-indexed, so 8th cell is index 7
-                chance_text = chance_cell.text.strip()
-                if chance_text and chance_text != '0%':
-                    try:
-                        chance = int(chance_text.replace('%', ''))
-                        rain_probability = chance
-                        if chance > 20:  # If more than 20% chance, consider it might rain
-                            has_rain = True
-                    except ValueError:
-                        pass
-            
-            # Create date object
-            year = datetime.datetime.now().year
-            # Handle December to January transition
-            if month_abbr == 'Jan' and datetime.datetime.now().month == 12:
-                year += 1
-            
-            # Convert month abbreviation to number
-            month_mapping = {
-                'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
-                'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
-            }
-            month_num = month_mapping.get(month_abbr, None)
-            
-            if not month_num:
-                print(f"Invalid month abbreviation: {month_abbr}")
-                continue
-            
-            date = datetime.date(year, month_num, day)
-            
-            forecast_data.append({
-                'date': date,
-                'day_of_week': day_of_week,
-                'description': weather_desc,
-                'has_rain': has_rain,
-                'rain_probability': rain_probability,
-                'temp_high': temp_high,
-                'temp_low': temp_low
-            })
-            
-        except Exception as e:
-            print(f"Error processing row: {e}")
-            continue
+    set_per_host_limit(per_host_limit)
     
-    print(f"Successfully extracted {len(forecast_data)} days of forecast data")
-    return forecast_data
-
-def is_weekend_day(date):
-    """Check if a date is a weekend day (Saturday or Sunday)."""
-    return date.weekday() >= 5  # 5 = Saturday, 6 = Sunday
-
-def is_weekend_adjacent(start_date, end_date):
-    """Check if a date range is adjacent to a weekend."""
-    # Check if the range includes a weekend
-    current_date = start_date
-    while current_date <= end_date:
-        if is_weekend_day(current_date):
-            return True
-        current_date += datetime.timedelta(days=1)
+    try:
+        configure_location_cache(ttl_days=option_value(options, 'location_ttl'), refresh=options.get('refresh_locations', False))
+    except ValueError:
+        print("Location TTL must be a number of days")
+        return
     
-    # Check if the range is adjacent to a weekend
-    before_start = start_date - datetime.timedelta(days=1)
-    after_end = end_date + datetime.timedelta(days=1)
+    gazetteer_path = options.get('gazetteer')
+    configure_gazetteer(enabled=not options.get('no_gazetteer'),
+                        path=gazetteer_path if gazetteer_path is not True else None)
     
-    return is_weekend_day(before_start) or is_weekend_day(after_end)
-
-def find_suitable_periods(forecast_data, trip_length):
-    """Find date ranges of specified length that meet weather criteria and are weekend-adjacent.
+    try:
+        configure_forecast_cache(
+            ttl_minutes=option_value(options, 'forecast_ttl'),
+            max_entries=option_value(options, 'forecast_cache_size'),
+            refresh=options.get('refresh_forecasts', False),
+            stream=options.get('stream', False)
+        )
+    except ValueError:
+        print("Forecast TTL and cache size must be numbers")
+        return
     
-    Args:
-        forecast_data: List of daily forecast dictionaries
-        trip_length: Number of NIGHTS to stay (n nights = n+1 days)
+    try:
+        parse_workers = options.get('parse_workers', 0)
+        configure_parse_pool(workers=(os.cpu_count() or 1) if parse_workers is True else parse_workers,
+                             batch_size=option_value(options, 'parse_batch'))
+    except ValueError:
+        print("Parse workers and batch size must be numbers")
+        return
     
-    Returns:
-        List of suitable periods that are weekend-adjacent
-    """
-    suitable_periods = []
+    try:
+        configure_calendar(pto_days=parse_pto_days(options['pto']) if options.get('pto') else None,
+                           holidays=not options.get('no_holidays'))
+    except ValueError:
+        print("PTO days must be ISO dates (2026-05-26) or ranges (2026-07-01..2026-07-03), comma-separated")
+        return
     
-    # Convert trip_length to integer
-    trip_length = int(trip_length)
+    try:
+        history = options.get('history')
+        configure_forecast_history(enabled=bool(history), path=history if history is not True else None,
+                                   fetches=option_value(options, 'history_fetches'))
+    except ValueError:
+        print("History fetches must be a number")
+        return
     
-    # For n nights, we need n+1 days
-    days_needed = trip_length + 1
+    try:
+        configure_hotel_cache(ttl_minutes=option_value(options, 'hotel_ttl'))
+    except ValueError:
+        print("Hotel TTL must be a number of minutes")
+        return
     
-    # Check each possible start date
-    for i in range(len(forecast_data) - days_needed + 1):
-        start_date = forecast_data[i]['date']
-        end_date = forecast_data[i + days_needed - 1]['date']
-        days_range = [forecast_data[i + j] for j in range(days_needed)]
-        
-        # Count rainy days in this period
-        rainy_days = sum(1 for day in days_range if day['has_rain'])
-        
-        # Check if rain on first or last day is ≤ 30%
-        start_day_rain_prob = days_range[0]['rain_probability'] or 0
-        end_day_rain_prob = days_range[-1]['rain_probability'] or 0
-        
-        # Debug output for each potential period
-        # print(f"\nEvaluating period: {start_date.strftime('%a, %b %d')} to {end_date.strftime('%a, %b %d')}")
-        # print(f"Rainy days: {rainy_days}/{days_needed} (needs < {days_needed / 2})")
-        # print(f"Start day rain: {start_day_rain_prob}% (needs ≤ 30%)")
-        # print(f"End day rain: {end_day_rain_prob}% (needs ≤ 30%)")
-        # print(f"Weekend adjacent: {is_weekend_adjacent(start_date, end_date)}")
-        
-        # # Print details for each day
-        # for j, day in enumerate(days_range):
-        #     print(f"  Day {j+1} ({day['date'].strftime('%a, %b %d')}): " +
-        #           f"Rain prob: {day['rain_probability'] or 0}%, " +
-        #           f"has_rain: {day['has_rain']}")
-        
-        # Check criteria:
-        # 1. Less than half the days have rain
-        # 2. Both departure and arrival have ≤ 30% rain probability
-        # 3. Is weekend-adjacent
-        if (rainy_days < days_needed / 2 and  # Less than half the days have rain
-            start_day_rain_prob <= 30 and     # ≤ 30% chance on departure
-            end_day_rain_prob <= 30 and       # ≤ 30% chance on arrival
-            is_weekend_adjacent(start_date, end_date)):  # Weekend-adjacent
-            
-            # print(f"✓ Period PASSES all criteria")
-            suitable_periods.append({
-                'start_date': start_date,
-                'end_date': end_date,
-                'days': days_range
-            })
-        # else:
-            # print(f"✗ Period FAILS criteria")
+    if options.get('mirror') is True:
+        print("Mirror must be a base URL or a JSON service URL containing {location_id}")
+        return
+    try:
+        if options.get('mirror'):
+            register_provider(provider_from_spec('mirror', options['mirror']))
+        configure_providers(backup='mirror' if options.get('mirror') else None,
+                            percentile=option_value(options, 'hedge_percentile'))
+    except ValueError:
+        print("Hedge percentile must be a number between 1 and 100")
+        return
     
-    return suitable_periods
-
-def generate_expedia_url(city_name, state_abbr, start_date, end_date, max_price):
-    """Generate an Expedia hotel search URL for the given parameters."""
-    # Format dates as YYYY-MM-DD
-    start_date_str = start_date.strftime("%Y-%m-%d")
-    end_date_str = end_date.strftime("%Y-%m-%d")
+    try:
+        budget = option_value(options, 'budget')
+        budget_per_hour = option_value(options, 'budget_per_hour')
+        if any(value is not None and int(value) < 1 for value in (budget, budget_per_hour)):
+            raise ValueError("Request budgets must be positive")
+        priority = option_value(options, 'priority')
+        configure_budget(per_run=budget, per_hour=budget_per_hour,
+                         priorities=parse_priorities(priority) if priority else None)
+    except ValueError:
+        print("Request budgets must be positive whole numbers, and priorities look like 'Ocean City, MD=2 & ...'")
+        return
     
-    # Create the destination string
-    if state_abbr:
-        destination = f"{city_name}, {state_abbr}, United States of America"
-    else:
-        destination = f"{city_name}, United States of America"
+    replay_server = None
+    if options.get('record') is True or options.get('replay') is True:
+        print("Record and replay need a fixture directory, e.g. --replay=fixtures/")
+        return
+    if options.get('record'):
+        start_recording(options['record'])
+    elif options.get('replay'):
+        try:
+            replay_server = start_replay(options['replay'], option_value(options, 'replay_latency'),
+                                         option_value(options, 'replay_error_rate', 0))
+        except ValueError:
+            print("Replay latency must be milliseconds (e.g. 50 or 20-200) and error rate a fraction")
+            return
     
-    # Build the base URL with parameters
-    base_url = "https://www.expedia.com/Hotel-Search"
+    # Cache maintenance commands run on their own
+    if options.get('clear_location_cache'):
+        removed = clear_location_cache()
+        print(f"Removed {removed} cached locations from {location_cache_path()}")
+        if len(args) < 3:
+            return
     
-    # Format the URL with explicit price range (min=0, max=specified)
-    query_parts = [
-        f"MDPCID=US.META.HPA.HOTEL-CORESEARCH-desktop.HOTEL",
-        f"adults=2",
-        f"children=",
-        f"destination={quote_plus(destination)}",
-        f"endDate={end_date_str}",
-        f"startDate={start_date_str}",
-        f"sort=REVIEW_RELEVANT",
-        f"paymentType=FREE_CANCELLATION",
-        f"price=0",  # Min price
-        f"price={max_price}",  # Max price
-        f"stay_options_group=hotels_option"  # Ensure only hotels (not vacation homes) are shown
-    ]
+    if options.get('prewarm_locations'):
+        if options['prewarm_locations'] is True:
+            print("Prewarming needs a file of city names: --prewarm-locations=FILE")
+            return
+        try:
+            city_names = read_city_list(options['prewarm_locations'])
+        except OSError as e:
+            print(f"Could not read city list: {e}")
+            return
+        already_cached, resolved, failed = prewarm_locations(city_names, concurrency)
+        print(f"\nLocation cache: {len(already_cached)} already cached, {len(resolved)} resolved, {len(failed)} failed")
+        for city_name in failed:
+            print(f"   Could not resolve: {city_name}")
+        return
     
-    # Join all parts with &
-    query_string = "&".join(query_parts)
+    if options.get('batch'):
+        try:
+            queries = read_batch_queries(options['batch'])
+        except (OSError, ValueError) as e:
+            print(f"Could not read batch file: {e}")
+            return
+        if not isinstance(queries, list):
+            print("Batch file must hold a JSON array or one JSON object per line")
+            return
+        if jsonl:
+            for summary in run_batch(queries, concurrency):
+                sys.stdout.write(json.dumps(summary) + '\n')
+            sys.stdout.flush()
+            return
+        answered, _, _ = answer_batch(queries, concurrency)
+        for number, (query, results, _) in enumerate(answered, 1):
+            if results is None:
+                print(f"\nQuery {number}: invalid query: {query}")
+                continue
+            title = (f"QUERY {number}: {format_trip_lengths(query['trip_length'])} nights, max ${query['max_price']}, "
+                     f"{len(query['city_names'])} cities")
+            if results:
+                print_summary(results, title)
+            else:
+                print(f"\n{title}\nNo suitable periods found.")
+        return
     
-    return f"{base_url}?{query_string}"
-
-def main():
-    if len(sys.argv) < 4:
-        print("Usage: python weather_trip_planner.py <trip_length_in_nights> <max_price> <city_name1> [& <city_name2> ...]")
-        print("Example: python weather_trip_planner.py 2 400 'Ocean City, MD & Virginia Beach, VA'")
+    if options.get('serve'):
+        try:
+            port = DEFAULT_API_PORT if options['serve'] is True else int(options['serve'])
+        except ValueError:
+            print("Server port must be a number")
+            return
+        if options.get('host') is True:
+            print("Host must be an address to listen on, e.g. --host=0.0.0.0")
+            return
+        serve(port, concurrency, options.get('host', '127.0.0.1'))
+        return
+    
+    if len(args) < 3:
+        print_usage()
         return
     
     try:
-        trip_length = int(sys.argv[1])
-        if trip_length < 1:
-            print("Trip length must be a positive integer")
-            return
+        trip_lengths = parse_trip_lengths(args[0])
     except ValueError:
-        print("Trip length must be a number")
+        print(f"Trip length must be 1 to {MAX_TRIP_LENGTH} nights, a range like 1-3, or a list like 1,2,4")
         return
+    # A single length keeps the plain integer everywhere downstream
+    trip_length = trip_lengths[0] if len(trip_lengths) == 1 else trip_lengths
     
     try:
-        max_price = int(sys.argv[2])
+        max_price = int(args[1])
         if max_price < 1:
             print("Max price must be a positive integer")
             return
@@ -559,33 +4014,183 @@ def main():
         return
     
     # Get the city list - the rest of the arguments may form a single string with '&' separators
-    city_input = ' '.join(sys.argv[3:])
-    city_names = [city.strip() for city in city_input.split('&')]
+    city_input = ' '.join(args[2:])
+    city_names = [city.strip() for city in city_input.split('&') if city.strip()]
     
     if not city_names:
         print("No cities specified")
         return
     
-    # Process each city
-    all_results = []
-    for city_name in city_names:
-        if not city_name.strip():
-            continue
+    try:
+        top_k = int(option_value(options, 'top')) if 'top' in options else None
+        if top_k is not None and top_k < 1:
+            raise ValueError
+    except ValueError:
+        print("Top must be a positive integer")
+        return
+    
+    if options.get('watch'):
+        try:
+            interval = DEFAULT_WATCH_INTERVAL_MINUTES if options['watch'] is True else float(options['watch'])
+            rounds = int(option_value(options, 'watch_rounds')) if 'watch_rounds' in options else None
+            if rounds is not None and rounds < 1:
+                raise ValueError
+        except ValueError:
+            print("Watch interval must be a number of minutes and watch rounds a positive number")
+            return
+        if jsonl:
+            def on_change(added, removed):
+                for result in added:
+                    write_jsonl_record('added', result)
+                for result in removed:
+                    write_jsonl_record('removed', result)
+        else:
+            on_change = print_period_changes
+    
+    # Process each city (watch mode plans each check itself)
+    watching = bool(options.get('watch'))
+    plan = None if watching else plan_requests(city_names)
+    ranked = bool(options.get('rank'))
+    if watching:
+        def run(*run_args):
+            nonlocal plan
+            try:
+                plan = watch(*run_args)
+            except KeyboardInterrupt:
+                pass
+            return []
+        run_args = (city_names, trip_length, max_price, interval, concurrency, on_change, rounds)
+    elif ranked:
+        try:
+            ranking_settings = parse_ranking_options(options)
+        except ValueError as e:
+            print(f"Invalid ranking option: {e}")
+            return
+        run = rank_cities
+        run_args = (city_names, trip_length, max_price, ranking_settings, top_k or DEFAULT_TOP_K, concurrency, plan)
+    elif jsonl or top_k:
+        emit = prepare = None
+        if jsonl:
+            def prepare(city_results):
+                # One batch of hotel searches and history reads per city, not per period
+                if options.get('hotels'):
+                    attach_hotel_results(city_results, concurrency, save=False)
+                if history_enabled():
+                    attach_forecast_trends(city_results)
+                return city_results
             
-        city_results = process_city(city_name.strip(), trip_length, max_price)
-        all_results.extend(city_results)
+            def emit(result):
+                write_jsonl_record('period', result)
+        run = stream_cities
+        run_args = (city_names, trip_length, max_price, concurrency, top_k, emit, prepare, plan)
+    else:
+        run = process_cities
+        run_args = (city_names, trip_length, max_price, concurrency, plan)
+    
+    profile_path = options.get('profile')
+    if profile_path:
+        enable_metrics()
+    if options.get('cprofile') and concurrency > 1:
+        log.warning("cProfile only sees the main thread; use --concurrency=1 for a complete profile")
+    
+    run_start = time.perf_counter()
+    if options.get('cprofile'):
+        cprofile_path = options['cprofile'] if options['cprofile'] is not True else 'weather_trip_planner.prof'
+        all_results = run_with_cprofile(cprofile_path, run, *run_args)
+    else:
+        all_results = run(*run_args)
+    
+    if options.get('hotels'):
+        attach_hotel_results(all_results, concurrency, save=False)
+        save_hotel_cache()
+    if history_enabled():
+        flush_forecast_history()
+        attach_forecast_trends(all_results)
+    save_schedule_state()
+    save_location_cache()
+    print_budget_report(budget_report(plan), report)
+    
+    if profile_path:
+        if profile_path is True:
+            profile_path = 'profile.jsonl'
+        write_profile_report(profile_path, {
+            'type': 'run',
+            'wall_seconds': time.perf_counter() - run_start,
+            'cities': len(city_names),
+            'results': len(all_results),
+            'concurrency': concurrency,
+            'events': transport_stats()
+        })
+        print(f"\nProfile written to {profile_path}", file=report)
+    
+    if replay_server is not None:
+        stats = replay_server.stats
+        print(f"\nReplay server: {stats['requests']} requests, {stats['misses']} not recorded, "
+              f"{stats['injected_errors']} injected errors", file=report)
+        replay_server.shutdown()
+        replay_server.server_close()
+    
+    if options.get('stats'):
+        stats = transport_stats()
+        print(f"\nHTTP: {stats['requests']} requests, {stats['retries']} retries, {stats['failures']} failures", file=report)
+        print(f"Connections: {stats['new_connections']} new, {stats['reused_connections']} reused", file=report)
+        print(f"Gazetteer: {stats.get('gazetteer_hits', 0)} hits, {stats.get('gazetteer_misses', 0)} misses", file=report)
+        print(f"Forecast cache: {stats.get('forecast_cache_hits', 0)} hits, "
+              f"{stats.get('forecast_cache_revalidated', 0)} revalidated, {stats.get('forecast_unchanged', 0)} unchanged, "
+              f"{stats.get('forecast_cache_misses', 0)} misses",
+              file=report)
+        for name, provider in provider_stats().items():
+            print(f"Provider {name}: {provider['responses']} responses, {provider['failures']} failures, "
+                  f"p50 {provider['p50_ms']} ms, p95 {provider['p95_ms']} ms", file=report)
+        if options.get('mirror'):
+            print(f"Hedging: {stats.get('hedged_requests', 0)} backup requests, "
+                  f"{stats.get('hedge_wins', 0)} answered first by the mirror", file=report)
+        if options.get('hotels'):
+            print(f"Hotel searches: {stats.get('hotel_cache_hits', 0)} cached, "
+                  f"{stats.get('hotel_requests_coalesced', 0)} coalesced, "
+                  f"{stats.get('hotel_queries_deduplicated', 0)} duplicate periods", file=report)
+        if history_enabled():
+            print(f"Forecast history: {stats.get('history_rows_written', 0)} days written to {history_path()}", file=report)
+        if stats.get('pool_pages_parsed'):
+            print(f"Parse pool: {stats['pool_pages_parsed']} pages parsed in worker processes", file=report)
+        if stats.get('stream_bytes_read'):
+            print(f"Streaming: {stats['stream_bytes_read']} bytes read, {stats.get('stream_bytes_saved', 0)} bytes saved, "
+                  f"{stats.get('stream_early_stops', 0)} early stops", file=report)
+    
+    if watching:
+        return
+    
+    if jsonl:
+        # Periods were written as they were found; finish with the ranked view if one was asked for
+        if ranked or top_k:
+            for rank, result in enumerate(all_results, 1):
+                write_jsonl_record('top', result, rank)
+        return
     
     # Final summary of all results
     if not all_results:
         print("\nNo suitable periods found for any cities.")
         return
     
+    if ranked:
+        print_summary(all_results, "TOP RANKED RESULTS")
+    elif top_k:
+        print_summary(all_results, f"TOP {top_k} RESULTS (LEAST RAIN)")
+    elif options.get('fewest_days_off'):
+        all_results.sort(key=days_off_order)
+        print_summary(all_results, "SUMMARY OF ALL RESULTS (FEWEST DAYS OFF FIRST)")
+    else:
+        all_results.sort(key=lambda x: x['start_date'])  # Sort by start date
+        print_summary(all_results, "SUMMARY OF ALL RESULTS")
+    
+    prompt_open_urls(all_results)
+
+def print_summary(all_results, title):
+    """Print the numbered summary of results."""
     print("\n" + "="*50)
-    print("SUMMARY OF ALL RESULTS")
+    print(title)
     print("="*50)
     
-    all_results.sort(key=lambda x: x['start_date'])  # Sort by start date
-    
     for i, result in enumerate(all_results, 1):
         # Extract temperature and rain probability information
         temp_rain_info = []
@@ -599,7 +4204,28 @@ def main():
         print(f"{i}. {result['city']}: {result['start_date_str']} to {result['end_date_str']} ({result['nights']} nights)")
         print(f"   Weather: {temp_rain_summary}")
         print(f"   Rain percentage: {result['rain_percentage']:.1f}%")
-    
+        if result.get('days_off_needed') is not None:
+            holidays = f" ({', '.join(result['holidays'])})" if result['holidays'] else ""
+            print(f"   Days off needed: {result['days_off_needed']}{holidays}")
+        if len(result.get('rain_trend') or []) > 1:
+            trend = " -> ".join(f"{average:.0f}%" for average in result['rain_trend'])
+            print(f"   Rain trend over the last {len(result['rain_trend'])} forecasts: {trend}")
+        if 'hotels' in result:
+            if result['hotels'] is None:
+                print("   Hotels: results unavailable")
+            elif not result['hotels']:
+                print("   Hotels: none found")
+            else:
+                best = result['hotels'][0]
+                price = f"from ${result['min_price']:.0f}" if result['min_price'] is not None else "prices not shown"
+                rating = f", best rated {best['rating']}/10 ({best['name']})" if best['rating'] is not None else ""
+                print(f"   Hotels: {result['hotel_count']} found, {price}{rating}")
+        if 'score' in result:
+            print(f"   Score: {result['score']:.3f} (dry {result['rain_score']:.2f}, "
+                  f"comfort {result['comfort_score']:.2f}, weekend {result['weekend_score']:.2f})")
+
+def prompt_open_urls(all_results):
+    """Ask which results to open and open their hotel search URLs in the browser."""
     print("\nDo you want to open any of the hotel search URLs? (Enter numbers separated by comma, or 'all')")
     selection = input("Selection: ")
     
@@ -612,6 +4238,8 @@ def main():
             print("Invalid selection. No URLs opened.")
             return
     
+    import webbrowser
+    
     for idx in indices:
         if 1 <= idx <= len(all_results):
             result = all_results[idx - 1]